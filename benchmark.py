@@ -0,0 +1,284 @@
+"""
+Benchmarks for the slow parts of the analysis: same_shape_chi, process_obs and process_model (image_chi.py),
+plotData (which calls correctReddening for every point) and plotModel (plotter.py), and plot and bigPlot
+(vtuContourPlotter.py).
+
+The inputs are made up rather than real TORUS output, so the benchmarks can be run anywhere:
+    - observed and model FITS images (281 by 281 by default, can be bigger) with a bright ring like the disk
+    - a photometry file in the same format as mwc275_phot_cleaned_0.dat
+    - sed_inc files at several inclinations (plus the _direct files), in the TORUS column layout
+    - lucy .vtu files with an AMR grid that gets finer towards the star, with temperature, dust1, dust2 and rho
+
+Each benchmark is run a few times for the timing, then once more under tracemalloc for the peak memory
+(tracemalloc sees numpy arrays but not memory allocated inside VTK). Results are saved as JSON. Passing an
+earlier results file with --compare prints how much each benchmark has sped up or slowed down.
+
+python3 benchmark.py --out bench.json
+python3 benchmark.py --sizes 281,561 --cells 10000,100000,1000000 --repeat 5 --out bench.json
+python3 benchmark.py --only plot,bigPlot --compare old_bench.json
+
+bigPlot draws nine contour plots, so at 10^6 cells it takes a while.
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+scale = 6.685 * (10 ** -4) # TORUS grid units to AU, same as vtuContourPlotter
+
+def ringImage(size, center, rng, radius = 40.0, width = 8.0):
+    """
+    A bright ring plus a faint halo and some noise, roughly like the scattered light image.
+    """
+    Y, X = np.ogrid[:size, :size]
+    r = np.sqrt((X - center[0]) ** 2 + (Y - center[1]) ** 2)
+    image = 4.0 * np.exp(-((r - radius) / width) ** 2) + 0.5 * np.exp(-r / 50.0)
+    image += rng.normal(0, 0.05, (size, size))
+    return np.abs(image) + 1e-3
+
+def makeObsFits(path, size = 281, seed = 0):
+    """
+    An observed image cube like the GPI file: process_obs uses slice [1] and the STAR_X/STAR_Y header values.
+    """
+    from astropy.io import fits
+
+    rng = np.random.default_rng(seed)
+    center = ((size - 1) / 2, (size - 1) / 2)
+    cube = np.array([ringImage(size, center, rng) for i in range(4)], dtype = np.float32)
+    hdu = fits.PrimaryHDU(cube)
+    hdu.header['STAR_X'] = center[0]
+    hdu.header['STAR_Y'] = center[1]
+    hdu.writeto(path, overwrite = True)
+    return path
+
+def makeModelFits(path, size = 281, seed = 1):
+    """
+    A TORUS model image. process_model crops to 281 pixels after rotating, so size has to be at least 281.
+    """
+    from astropy.io import fits
+
+    rng = np.random.default_rng(seed)
+    center = ((size - 1) / 2, (size - 1) / 2)
+    fits.PrimaryHDU(ringImage(size, center, rng)).writeto(path, overwrite = True)
+    return path
+
+def makePhotometry(path, points = 200, seed = 2):
+    """
+    A photometry file like mwc275_phot_cleaned_0.dat: three header lines, then
+    'wavelength(m) source:band lamFlam error' lines.
+    """
+    rng = np.random.default_rng(seed)
+    sources = ('2MASS:J', '2MASS:H', 'WISE:W1', 'Spitzer:IRAC', 'Johnson:V', 'Cousins:R', 'SCUBA:850')
+    lam = np.sort(10 ** rng.uniform(-6.6, -3, points)) # 0.25 to 1000 microns
+    with open(path, 'w') as f:
+        f.write('# synthetic photometry\n# lambda source lamFlam error\n#\n')
+        for l in lam:
+            flux = 1e-11 * (l * 1e6) ** -1 * (1 + rng.uniform(0, 0.2))
+            f.write(str(l) + ' ' + sources[rng.integers(len(sources))] + ' ' + str(flux) + ' ' + str(0.1 * flux) + '\n')
+    return path
+
+def makeSEDs(directory, inclinations = (42, 50, 60), points = 2000, seed = 3):
+    """
+    sed_inc files in a directory, one per inclination plus a _direct file for each. The columns are
+    separated by five spaces, which is what plotModel splits on.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok = True)
+    lam = np.logspace(-1, 3.5, points) # microns
+    for inc in inclinations:
+        for suffix in ('', '_direct'):
+            flux = 1e-11 * lam ** -1 * np.exp(-lam / 3000) * (1 + rng.uniform(0, 0.1, points))
+            with open(os.path.join(directory, 'sed_inc' + '%03d' % inc + suffix + '.dat'), 'w') as f:
+                f.write('     lambda     flux     scattered     thermal\n')
+                for l, fl in zip(lam, flux):
+                    f.write('     ' + '%.6E' % l + '     ' + '%.6E' % fl + '     0.000000E+00     0.000000E+00\n')
+    return directory
+
+def amrCells(target, size = 750000.0, seed = 4):
+    """
+    Square cells (x0, y0, side) of a 2D AMR grid covering x in [0, size], y in [-size/2, size/2],
+    refined towards the star at the origin until there are at least target cells.
+    """
+    rng = np.random.default_rng(seed)
+    x0 = np.array([0.0])
+    y0 = np.array([-size / 2])
+    side = np.array([size])
+    while len(side) < target:
+        r = np.hypot(x0 + side / 2, y0 + side / 2)
+        score = side / (r + side) * (1 + 0.1 * rng.random(len(side))) # split big cells near the star first
+        nsplit = min(len(side), int(np.ceil((target - len(side)) / 3)))
+        split = np.zeros(len(side), dtype = bool)
+        split[np.argsort(score)[-nsplit:]] = True
+        half = side[split] / 2
+        xs, ys = x0[split], y0[split]
+        x0 = np.concatenate([x0[~split], xs, xs + half, xs, xs + half])
+        y0 = np.concatenate([y0[~split], ys, ys, ys + half, ys + half])
+        side = np.concatenate([side[~split], half, half, half, half])
+    return x0, y0, side
+
+def makeLucyVTU(path, cells = 10000, seed = 4):
+    """
+    A lucy .vtu file with the variables vtuContourPlotter uses (temperature, dust1, dust2, rho) as cell data.
+    """
+    import pyvista as pv
+
+    x0, y0, side = amrCells(cells, seed = seed)
+    n = len(side)
+    corners = np.stack([np.stack([x0, y0], 1), np.stack([x0 + side, y0], 1),
+                        np.stack([x0 + side, y0 + side], 1), np.stack([x0, y0 + side], 1)], 1).reshape(-1, 2)
+    points = np.column_stack([corners, np.zeros(len(corners))])
+    cellArray = np.column_stack([np.full(n, 4), np.arange(4 * n).reshape(n, 4)]).ravel()
+    grid = pv.UnstructuredGrid(cellArray, np.full(n, pv.CellType.QUAD, dtype = np.uint8), points)
+
+    xc, yc = (x0 + side / 2) * scale, (y0 + side / 2) * scale # AU
+    r = np.hypot(xc, yc) + 0.05
+    height = np.abs(yc) / (0.1 * r ** 1.25 + 1e-3)
+    rho = 1e-13 * r ** -2.25 * np.exp(-0.5 * height ** 2)
+    rho[rho < 1e-30] = 0.0 # some empty cells, like the real grids
+    grid.cell_data['rho'] = rho
+    grid.cell_data['temperature'] = 1500 * r ** -0.5
+    grid.cell_data['dust1'] = np.where(r > 0.3, 0.01 * np.exp(-0.5 * height ** 2), 0.0)
+    grid.cell_data['dust2'] = np.where(r > 0.3, 0.001 * np.exp(-height ** 2), 0.0)
+    grid.save(path)
+    return path
+
+def timeIt(func, repeat):
+    """
+    Wall times of repeat calls, and the tracemalloc peak of one more call.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'times': times, 'min': min(times), 'median': statistics.median(times), 'peak_bytes': peak}
+
+def benchmarks(workdir, sizes, cells, only = None):
+    """
+    Makes the inputs and returns a list of (name, parameters, function) to time. only is a set of
+    benchmark names; inputs that none of them need aren't made.
+    """
+    def wanted(*names):
+        return only is None or any(name in only for name in names)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # only import what's needed: plotter imports curveFitChi, which isn't in every checkout
+    benches = []
+    for size in sizes:
+        if not wanted('process_obs', 'process_model', 'same_shape_chi'):
+            break
+        import image_chi
+        obsPath = makeObsFits(os.path.join(workdir, 'obs_' + str(size) + '.fits'), size)
+        modelPath = makeModelFits(os.path.join(workdir, 'model_' + str(size) + '.fits'), size)
+        a = image_chi.process_model(modelPath)
+        b = image_chi.process_obs(obsPath)[:len(a), :len(a)]
+        def processObs(p = obsPath):
+            image_chi._mask_cache.clear() # time making the mask too, not just the cache
+            return image_chi.process_obs(p)
+        def processModel(p = modelPath):
+            image_chi._mask_cache.clear()
+            return image_chi.process_model(p)
+        benches.append(('process_obs', {'size': size}, processObs))
+        benches.append(('process_model', {'size': size}, processModel))
+        benches.append(('same_shape_chi', {'size': len(a)}, lambda a = a, b = b: image_chi.same_shape_chi(a, b)))
+
+    if wanted('plotData', 'plotModel'):
+        import plotter
+        photPath = makePhotometry(os.path.join(workdir, 'phot.dat'))
+        sedPath = os.path.join(makeSEDs(os.path.join(workdir, 'seds')), 'sed_inc042.dat')
+        def sedPlot():
+            plotter._dataCache.clear() # time the reading and reddening correction, not the cache
+            plt.figure()
+            plotter.plotData(photPath)
+            plt.close('all')
+        benches.append(('plotData', {'points': 200}, sedPlot))
+        benches.append(('plotModel', {'points': 2000}, lambda: plotter.plotModel(sedPath, 1e-20)))
+
+    for n in cells:
+        if not wanted('plot', 'bigPlot'):
+            break
+        import vtuContourPlotter
+        lucyDir = os.path.join(workdir, 'lucy' + str(n))
+        os.makedirs(lucyDir, exist_ok = True)
+        makeLucyVTU(os.path.join(lucyDir, 'lucy_1.vtu'), n)
+        benches.append(('plot', {'cells': n}, lambda d = lucyDir: vtuContourPlotter.plot('lucy_1.vtu', 'temperature', d)))
+        benches.append(('bigPlot', {'cells': n}, lambda d = lucyDir: vtuContourPlotter.bigPlot('lucy_1.vtu', d)))
+    return benches
+
+def gitVersion():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(results, oldPath):
+    """
+    Prints the change in median time for each benchmark found in both files.
+    """
+    with open(oldPath, 'r') as f:
+        old = json.load(f)
+    oldTimes = {(r['name'], json.dumps(r['params'], sort_keys = True)): r['median'] for r in old['results']}
+    for r in results:
+        key = (r['name'], json.dumps(r['params'], sort_keys = True))
+        if key in oldTimes:
+            ratio = r['median'] / oldTimes[key]
+            print('%-16s %-20s %8.4fs -> %8.4fs  (%.2fx)' % (r['name'], key[1], oldTimes[key], r['median'], ratio))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Time the slow parts of the analysis on made up inputs.')
+    parser.add_argument('--sizes', default = '281,561', help = 'FITS image sizes in pixels (at least 281)')
+    parser.add_argument('--cells', default = '10000,100000,1000000', help = 'number of cells in the lucy grids')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--only', default = None, help = 'comma separated benchmark names to run')
+    parser.add_argument('--out', default = 'bench_output.json')
+    parser.add_argument('--compare', default = None, help = 'earlier results file to compare against')
+    parser.add_argument('--keep', default = None, help = 'directory to keep the generated inputs in')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    cells = [int(c) for c in args.cells.split(',')]
+    only = None if args.only is None else set(args.only.split(','))
+
+    workdir = args.keep or tempfile.mkdtemp(prefix = 'ppd_bench_')
+    os.makedirs(workdir, exist_ok = True)
+    results = []
+    try:
+        for name, params, func in benchmarks(workdir, sizes, cells, only):
+            if only is not None and name not in only:
+                continue
+            result = {'name': name, 'params': params}
+            result.update(timeIt(func, args.repeat))
+            results.append(result)
+            print('%-16s %-20s median %8.4fs  peak %8.1f MB' % (name, json.dumps(params), result['median'], result['peak_bytes'] / 1e6))
+    finally:
+        if args.keep is None:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    output = {'version': gitVersion(), 'python': platform.python_version(), 'machine': platform.platform(),
+              'time': time.time(), 'repeat': args.repeat, 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent = 1)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
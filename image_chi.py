@@ -9,6 +9,7 @@ import numpy as np
 from astropy.io import fits
 from scipy.ndimage import rotate
 from scipy.ndimage import gaussian_filter
+import tracing
 
 def mask_circle(image, center, radius = 10.0, filler = np.nan, keep = 1.0): 
     """
@@ -31,15 +32,22 @@ def show_model(modelImagePath):
     plt.imshow(data_model, origin = 'lower', vmin = 0, vmax=3)
     plt.show()
 
+_mask_cache = {} # masks only depend on the image shape and center, so they are reused in long-running processes (worker.py)
+
 def create_full_mask(image, center):
     """
-    Makes a donut mask at the size of a given image.
+    Makes a donut mask at the size of a given image. The mask is shared between calls, so it is read-only.
     """
-    ones_array = np.ones(np.shape(image))
-    inner_mask = mask_circle(ones_array, center)
-    full_mask = mask_circle(inner_mask, center, radius = 60., filler = 1.0, keep = np.nan) # filler and keep values are reversed. makes everything outside of ring blank
-    return full_mask
+    key = (np.shape(image), tuple(center))
+    if key not in _mask_cache:
+        ones_array = np.ones(np.shape(image))
+        inner_mask = mask_circle(ones_array, center)
+        full_mask = mask_circle(inner_mask, center, radius = 60., filler = 1.0, keep = np.nan) # filler and keep values are reversed. makes everything outside of ring blank
+        full_mask.flags.writeable = False
+        _mask_cache[key] = full_mask
+    return _mask_cache[key]
 
+@tracing.traced('image_chi.chi')
 def same_shape_chi(image_model, image_obs):
     """
     Calculates the chi-squared value of two images of the same size.
@@ -68,21 +76,24 @@ def process_obs(obsImagePath):
     Some values are hardcoded and will not work properly for other fits files.
     """
 
-    hdul_obs = fits.open(obsImagePath)
-    data_obs = hdul_obs[0].data
-    header_obs = hdul_obs[0].header
-    hdul_obs.close()
+    with tracing.stage('image_chi.fits_read', path = obsImagePath):
+        hdul_obs = fits.open(obsImagePath)
+        data_obs = hdul_obs[0].data
+        header_obs = hdul_obs[0].header
+        hdul_obs.close()
 
     center_obs = (header_obs['STAR_X'], header_obs['STAR_Y'])
     # would like a nicer way to find the center that isn't dependent on the header (not usable if the header does not have those columns)
 
-    full_mask = create_full_mask(data_obs[1], center_obs)
+    with tracing.stage('image_chi.mask'):
+        full_mask = create_full_mask(data_obs[1], center_obs)
 
-    image_obs = full_mask * data_obs[1] # apply the mask
+        image_obs = full_mask * data_obs[1] # apply the mask
 
-    image_obs[image_obs == 0.0] = np.nan # why is this here? TODO: figure out why this line needs to be here, even though mask updated to nans
+        image_obs[image_obs == 0.0] = np.nan # why is this here? TODO: figure out why this line needs to be here, even though mask updated to nans
 
-    blurred_image_obs = gaussian_filter(image_obs, sigma=1) # smooth out the noise
+    with tracing.stage('image_chi.blur'):
+        blurred_image_obs = gaussian_filter(image_obs, sigma=1) # smooth out the noise
 
     return blurred_image_obs
 
@@ -93,56 +104,109 @@ def process_model(modelImagePath, gaussian = True):
     I marked this difference with a bunch of !! just so it's obvious
     """
 
-    hdul_model = fits.open(modelImagePath)
-    data_model = hdul_model[0].data
-    hdul_model.close()
+    with tracing.stage('image_chi.fits_read', path = modelImagePath):
+        hdul_model = fits.open(modelImagePath)
+        data_model = hdul_model[0].data
+        hdul_model.close()
     #TODO: implement zscale - why is the inherent scale way different for this than for the observed data?
     # update - doesn't seem necessary after all, implementing the mask and the gaussian blur seems to have brought it
     # roughly in line with the observed data
 
-    rot_data_model = rotate(data_model,138., axes=(1,0)) # model is produced at the wrong orientation
+    with tracing.stage('image_chi.rotate'):
+        rot_data_model = rotate(data_model,138., axes=(1,0)) # model is produced at the wrong orientation
     center_coord = 1 + (len(rot_data_model) - 1)/2 # find the center of the rotated image
     center_model = (center_coord, center_coord)
 
-    full_mask = create_full_mask(rot_data_model, center_model) # create the mask
+    with tracing.stage('image_chi.mask'):
+        full_mask = create_full_mask(rot_data_model, center_model) # create the mask
     
-    image_model = full_mask * rot_data_model # !!!!! apply the mask. This is the big difference - note that process_obs
-                                                # uses data_obs[1] whereas this just uses rot_data_model.
+        image_model = full_mask * rot_data_model # !!!!! apply the mask. This is the big difference - note that process_obs
+                                                    # uses data_obs[1] whereas this just uses rot_data_model.
     
     image_model = image_model[int(center_model[0] - 281/2):int(center_model[0] + 281/2),int(center_model[1] - 281/2):int(center_model[1] + 281/2)]
     # the rotated image has dimensions greater than the unrotated image (the square is tipped onto a corner), so this trims it back to the original size.
     # no relevant data from the model is lost from cropping - the only things that get cropped should be nans & the original corners at this point
     
     if gaussian:
-        blurred_image_model = gaussian_filter(image_model, sigma=1) # smooth the model
+        with tracing.stage('image_chi.blur'):
+            blurred_image_model = gaussian_filter(image_model, sigma=1) # smooth the model
         return blurred_image_model
     
     return image_model
 
-def main():
+def score_image(modelname, pathname, obsPath = 'MWC_275_GPI_2014-04-24_J.fits', image_obs = None):
     """
-    Command line function. Processes the model and observed images and calculates the chi squared.
+    Processes the model and observed images, calculates the chi squared, saves a side-by-side plot and
+    records the result. Returns the chi squared. image_obs can be passed in if the observed image has
+    already been processed (e.g. by worker.py), otherwise it is processed from obsPath.
     Most of this is completely adjustable.
     """
-    import sys
+    import os
+    import tempfile
+    import time
+    import resultsDB
+    import modelCache
+
+    start = time.perf_counter()
+    outPath = modelname + '_image_chi.png'
+    paramPath = resultsDB.findParamFile(os.path.dirname(pathname))
+
+    # the model image is part of the key, since one model directory can have images at several inclinations
+    key = modelCache.cacheKey('image_chi', paramPath, (obsPath, pathname))
+    cached = modelCache.lookup(key)
+    chi = None
+    image_model = None
+    if cached is not None: # same parameters already scored
+        if cached['values'].get('model') == modelname and modelCache.restore(cached, 'image_chi_png', outPath):
+            resultsDB.record(modelname, paramPath = paramPath, imageChi = cached['values']['chi'],
+                             runtimes = {'image_chi': time.perf_counter() - start}, artifacts = {'image_chi_png': outPath})
+            return cached['values']['chi']
+        try: # the plot has the other model's name on it, so only reuse the processed image and redraw
+            image_model = np.load(cached['artifacts']['image_model'])
+            chi = cached['values']['chi']
+        except (OSError, KeyError, ValueError):
+            pass
 
-    pathname = str(sys.argv[2])
-    modelname = str(sys.argv[1])
     fig, (ax1, ax2) = plt.subplots(1,2)
-    image_model = process_model(pathname)
-    ax1.imshow(image_model, vmin = 0, vmax=5, origin = 'lower')
-    ax1.set_title('Model')
-    image_obs = process_obs('MWC_275_GPI_2014-04-24_J.fits')
-    ax2.imshow(image_obs, vmin = 0, vmax=5, origin = 'lower')
-    ax2.set_title('Observed')
-
-    ax1.set_xlim((50,250))
-    ax1.set_ylim((50,250))
-    ax2.set_xlim((50,250))
-    ax2.set_ylim((50,250))
-    plt.suptitle(modelname + ' chi: ' + str(same_shape_chi(image_model, image_obs)).split('.')[0], y=0.85)
-    plt.savefig(modelname + '_image_chi.png')
-    
+    try:
+        if image_model is None:
+            image_model = process_model(pathname)
+        ax1.imshow(image_model, vmin = 0, vmax=5, origin = 'lower')
+        ax1.set_title('Model')
+        if image_obs is None:
+            image_obs = process_obs(obsPath)
+        ax2.imshow(image_obs, vmin = 0, vmax=5, origin = 'lower')
+        ax2.set_title('Observed')
+
+        ax1.set_xlim((50,250))
+        ax1.set_ylim((50,250))
+        ax2.set_xlim((50,250))
+        ax2.set_ylim((50,250))
+        if chi is None:
+            chi = same_shape_chi(image_model, image_obs)
+        plt.suptitle(modelname + ' chi: ' + str(chi).split('.')[0], y=0.85)
+        with tracing.stage('image_chi.render', path = outPath):
+            plt.savefig(outPath)
+    finally:
+        plt.close(fig) # also when scoring fails, so the worker doesn't collect open figures
+
+    if cached is None:
+        with tempfile.TemporaryDirectory() as tmpDir:
+            modelPath = os.path.join(tmpDir, 'image_model.npy')
+            np.save(modelPath, image_model)
+            modelCache.store(key, {'chi': float(chi), 'model': modelname},
+                             {'image_chi_png': outPath, 'image_model': modelPath})
+    resultsDB.record(modelname, paramPath = paramPath, imageChi = chi,
+                     runtimes = {'image_chi': time.perf_counter() - start}, artifacts = {'image_chi_png': outPath})
+    return chi
+
+def main():
+    """
+    Command line function. python3 image_chi.py modelname model_image.fits
+    """
+    import sys
+
+    score_image(str(sys.argv[1]), str(sys.argv[2]))
 
 if __name__ == '__main__':
     main()
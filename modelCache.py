@@ -0,0 +1,180 @@
+"""
+A cache of finished model evaluations, so a model whose parameters file is identical to one that was
+already scored (e.g. when a sheet tab gets copied) doesn't get scored and plotted again.
+
+Each entry is keyed by the sha256 of the step name, the parameters file and the input data files
+(the observed and model FITS images, the photometry file), so changing any of them gives a new key. An entry
+holds the values the step produced (chi-squared values) and copies of the plots it saved. Entries
+live in .model_cache/<key>/.
+
+Entries are written to a temporary directory and renamed into place, and removed by renaming them out
+of the way first, so several workers can share the cache directory: a reader either sees a whole entry
+or none at all. If two workers evaluate the same model at the same time, the first one to finish wins
+and the other's entry is thrown away.
+
+A cached plot has the name of the model it was drawn for in its title, so it is only reused for that model.
+For a copy of the model under another name the chi values are reused and the plot is redrawn.
+
+python3 modelCache.py --evict N
+--  keeps only the N most recently used entries.
+python3 modelCache.py --clear
+--  removes every entry.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+cache_dir = '.model_cache'
+version = '2' # bump this if the scoring changes so old entries are no longer used
+
+def fileHash(path):
+    """
+    sha256 of a file's contents.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def writeAtomic(path, text):
+    """
+    Writes text to path through a temporary file next to it, so a crash or an interrupted run never leaves a
+    half-written file behind.
+    """
+    import threading
+
+    tmpPath = path + '.tmp-' + str(os.getpid()) + '-' + str(threading.get_ident())
+    try:
+        with open(tmpPath, 'w', newline = '') as f:
+            f.write(text)
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+def cacheKey(step, paramPath, dataPaths = ()):
+    """
+    Key for one step of one model. paramPath must be the model's own copy of its parameters file
+    (resultsDB.findParamFile), never a shared one in the working directory, or different models would
+    get the same key. Returns None if there is no parameters file, since then there's nothing to tell
+    models apart by and the result shouldn't be cached.
+    """
+    if paramPath is None or not os.path.exists(paramPath):
+        return None
+    h = hashlib.sha256()
+    h.update((version + '\0' + str(step) + '\0').encode())
+    h.update(fileHash(paramPath).encode())
+    for path in dataPaths:
+        h.update(b'\0' + fileHash(path).encode())
+    return h.hexdigest()
+
+def lookup(key, directory = cache_dir):
+    """
+    Returns the entry for key as a dictionary {'values': ..., 'artifacts': {kind: path in the cache}},
+    or None if there isn't one.
+    """
+    if key is None:
+        return None
+    entryDir = os.path.join(directory, key)
+    try:
+        with open(os.path.join(entryDir, 'entry.json'), 'r') as f:
+            entry = json.load(f)
+        os.utime(os.path.join(entryDir, 'entry.json')) # mark as recently used for evict()
+    except (OSError, ValueError):
+        return None
+    entry['artifacts'] = {kind: os.path.join(entryDir, name) for kind, name in entry['artifacts'].items()}
+    return entry
+
+def restore(entry, kind, destination):
+    """
+    Copies a cached plot to destination. Returns False if it has disappeared (e.g. evicted in the meantime).
+    """
+    try:
+        shutil.copyfile(entry['artifacts'][kind], destination)
+    except (OSError, KeyError):
+        return False
+    return True
+
+def store(key, values, artifacts = None, directory = cache_dir):
+    """
+    Saves values (anything json can write) and copies of the files in artifacts ({kind: path}) under key.
+    Does nothing if key is None or the entry already exists.
+    """
+    if key is None:
+        return
+    os.makedirs(directory, exist_ok = True)
+    entryDir = os.path.join(directory, key)
+    if os.path.exists(entryDir):
+        return
+
+    tmpDir = tempfile.mkdtemp(prefix = '.tmp-', dir = directory)
+    try:
+        names = {}
+        for kind, path in (artifacts or {}).items():
+            names[kind] = kind + os.path.splitext(path)[1]
+            shutil.copyfile(path, os.path.join(tmpDir, names[kind]))
+        with open(os.path.join(tmpDir, 'entry.json'), 'w') as f:
+            json.dump({'values': values, 'artifacts': names, 'created': time.time()}, f)
+        os.rename(tmpDir, entryDir)
+    except OSError:
+        pass # another worker got there first, or the cache isn't writable. Either way the result is still returned.
+    finally:
+        if os.path.exists(tmpDir):
+            shutil.rmtree(tmpDir, ignore_errors = True)
+
+def remove(key, directory = cache_dir):
+    """
+    Removes one entry. It is renamed out of the way first so readers never see half of it.
+    """
+    entryDir = os.path.join(directory, key)
+    trash = os.path.join(directory, '.trash-' + key + '-' + str(os.getpid()))
+    try:
+        os.rename(entryDir, trash)
+    except OSError:
+        return
+    shutil.rmtree(trash, ignore_errors = True)
+
+def entries(directory = cache_dir):
+    """
+    Returns (last used time, key) for every entry, most recently used first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for key in os.listdir(directory):
+        if key.startswith('.'):
+            continue
+        try:
+            found.append((os.path.getmtime(os.path.join(directory, key, 'entry.json')), key))
+        except OSError:
+            continue
+    found.sort(reverse = True)
+    return found
+
+def evict(maxEntries = None, maxAge = None, directory = cache_dir):
+    """
+    Removes the least recently used entries beyond maxEntries, and any entry not used in maxAge seconds.
+    Returns the number of entries removed.
+    """
+    now = time.time()
+    removed = 0
+    for i, (used, key) in enumerate(entries(directory)):
+        if (maxEntries is not None and i >= maxEntries) or (maxAge is not None and now - used > maxAge):
+            remove(key, directory)
+            removed += 1
+    return removed
+
+def clear(directory = cache_dir):
+    return evict(maxEntries = 0, directory = directory)
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1] == '--clear':
+        print(str(clear()) + ' entries removed')
+    elif sys.argv[1] == '--evict':
+        print(str(evict(maxEntries = int(sys.argv[2]))) + ' entries removed')
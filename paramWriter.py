@@ -1,45 +1,182 @@
 """
 Writes a new parameters file from a default file (modParameters.dat) and parameters given in a Google sheet.
+
+The parameters can come from a few places:
+    - a local CSV file laid out like the sheet (a 'Parameter ' column and a 'Value ' column)
+    - a local SQLite file with a table per sheet tab, each with Parameter and Value columns
+    - the Google sheet itself. The sheet is only downloaded the first time a tab is used (or when
+      --refresh is passed); after that a snapshot in .sheet_cache/ is used, so runs work offline.
+
+Ways to run the module:
+
+python3 paramWriter.py sheet_name
+--  uses the cached snapshot of the sheet tab, downloading it if there isn't one yet.
+
+python3 paramWriter.py sheet_name --refresh
+--  re-downloads the sheet tab before writing the parameters file.
+
+python3 paramWriter.py sheet_name --source params.csv (or params.db)
+--  reads the parameters from a local file instead. For a SQLite file, sheet_name is the table name.
+
+python3 paramWriter.py sheet_name --model-dir path/to/model
+--  also puts a copy of modParametersNEW.dat in the model's output directory, so the results of that model
+    (results.db, .model_cache) can be keyed on the parameters it was run with.
+
+python3 paramWriter.py sheet_name --url http://localhost:8000/{sheet}.csv
+--  downloads from a different address, e.g. a local server standing in for the sheet. {sheet} is
+    replaced with the sheet name. Combine with --refresh to bypass the cache.
+
+Only the standard library (and modelCache, which also only uses the standard library) is imported, so importing
+this module is quick.
 """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import sys
+import csv
+import io
+import os
+import shutil
+import sqlite3
+import urllib.parse
+import urllib.request
 
-sheet_name = str(sys.argv[1])
+import modelCache
 
 sheet_id = "1BuyxFfV0C_RqYA_5UKN6eLL2XMXL2SHtLsfW-oIPg88"
-sheet_url = "https://docs.google.com/spreadsheets/d/"  + sheet_id + "/gviz/tq?tqx=out:csv&sheet=" + sheet_name
+sheet_url = "https://docs.google.com/spreadsheets/d/" + sheet_id + "/gviz/tq?tqx=out:csv&sheet={sheet}"
+
+cache_dir = ".sheet_cache"
+
+def parseParamCSV(text):
+    """
+    Turns CSV text in the sheet's format into a dictionary of parameter name -> value (both strings).
+    The sheet headers have trailing spaces ('Parameter ', 'Value '), so headers and names are stripped.
+    """
+    reader = csv.reader(io.StringIO(text))
+    header = [col.strip() for col in next(reader)]
+    paramCol = header.index('Parameter')
+    valueCol = header.index('Value')
+
+    table = {}
+    for row in reader:
+        if len(row) <= max(paramCol, valueCol):
+            continue
+        name = row[paramCol].strip()
+        if name != '' and name not in table: # first entry wins, same as the old table.loc lookup
+            table[name] = row[valueCol].strip()
+    return table
+
+def csvSource(path):
+    """
+    Reads parameters from a local CSV file in the same format as the sheet.
+    """
+    with open(path, "r", newline = '') as f:
+        return parseParamCSV(f.read())
 
-table = pd.read_csv(sheet_url)
+def sqliteSource(path, sheet_name):
+    """
+    Reads parameters from a table called sheet_name in a local SQLite file.
+    The table needs Parameter and Value columns.
+    """
+    con = sqlite3.connect(path)
+    try:
+        rows = con.execute('SELECT Parameter, Value FROM "' + sheet_name.replace('"', '""') + '"').fetchall()
+    finally:
+        con.close()
 
-fp = "modParameters.dat"
-originalParams = open(fp, "r").read()
+    table = {}
+    for name, value in rows:
+        name = str(name).strip()
+        if name != '' and name not in table:
+            table[name] = str(value).strip()
+    return table
 
-lines = originalParams.splitlines()
+def cachePath(sheet_name, directory = cache_dir):
+    """
+    Where the snapshot of a sheet tab is kept.
+    """
+    return os.path.join(directory, urllib.parse.quote(sheet_name, safe = '') + '.csv')
 
-listOfVars = table["Parameter "].values.tolist()
+def refreshSheet(sheet_name, url = sheet_url, directory = cache_dir, timeout = 30):
+    """
+    Downloads a sheet tab and saves it as the cached snapshot. Returns the CSV text.
+    A failed download never leaves a half-written snapshot.
+    """
+    fullUrl = url.replace('{sheet}', urllib.parse.quote(sheet_name))
+    with urllib.request.urlopen(fullUrl, timeout = timeout) as response:
+        text = response.read().decode('utf-8')
+
+    parseParamCSV(text) # make sure it actually looks like the sheet before caching it
+
+    os.makedirs(directory, exist_ok = True)
+    modelCache.writeAtomic(cachePath(sheet_name, directory), text)
+    return text
+
+def sheetSource(sheet_name, refresh = False, url = sheet_url, directory = cache_dir):
+    """
+    Reads parameters from the cached snapshot of a sheet tab, downloading it first if
+    there is no snapshot yet or if refresh is True.
+    """
+    path = cachePath(sheet_name, directory)
+    if refresh or not os.path.exists(path):
+        return parseParamCSV(refreshSheet(sheet_name, url, directory))
+    return csvSource(path)
+
+def loadParams(sheet_name, source = None, refresh = False, url = sheet_url):
+    """
+    Picks the parameter source. source is a path to a local .csv or .db/.sqlite file; if it is
+    None the (cached) Google sheet is used.
+    """
+    if source is None:
+        return sheetSource(sheet_name, refresh = refresh, url = url)
+    if source.endswith(('.db', '.sqlite', '.sqlite3')):
+        return sqliteSource(source, sheet_name)
+    return csvSource(source)
 
 def replaceValue(line, index, newVal):
     first = line[:index]
     second = line[index+1:]
     return first + [newVal] + second
 
-with open("modParametersNEW.dat", "w") as f:
-    for line in lines:
-        line = line.split(" ")
-        varName = line[0]
-        if varName in listOfVars:
-            row = table.loc[table["Parameter "] == varName]
-            newVal = row["Value "].tolist()
-            newVal = newVal[0]
-            if 'nphot' in varName: # defaults to float but nphot, nphotimage, etc. need ints
-                newVal = int(newVal)
-            newVal = str(newVal)
-            valIndex = 1
-            line = replaceValue(line, valIndex, newVal)
-        outputLine = ""
-        for item in line:
-            outputLine += str(item) + " "
-        f.write(outputLine + '\n' )
-    f.close()
+def writeParams(table, fp = "modParameters.dat", outPath = "modParametersNEW.dat", modelDir = None):
+    """
+    Copies the default parameters file, swapping in any values found in table. If modelDir is given, the
+    new file is also copied there (see resultsDB.findParamFile).
+    """
+    originalParams = open(fp, "r").read()
+
+    lines = originalParams.splitlines()
+
+    with open(outPath, "w") as f:
+        for line in lines:
+            line = line.split(" ")
+            varName = line[0]
+            if varName in table:
+                newVal = table[varName]
+                if 'nphot' in varName: # defaults to float but nphot, nphotimage, etc. need ints
+                    newVal = int(float(newVal))
+                newVal = str(newVal)
+                valIndex = 1
+                line = replaceValue(line, valIndex, newVal)
+            outputLine = ""
+            for item in line:
+                outputLine += str(item) + " "
+            f.write(outputLine + '\n' )
+
+    if modelDir is not None:
+        os.makedirs(modelDir, exist_ok = True)
+        shutil.copyfile(outPath, os.path.join(modelDir, os.path.basename(outPath)))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Write modParametersNEW.dat from a sheet of parameters.')
+    parser.add_argument('sheet_name')
+    parser.add_argument('--source', default = None, help = 'local .csv or .db file to read instead of the sheet')
+    parser.add_argument('--refresh', action = 'store_true', help = 're-download the sheet instead of using the cache')
+    parser.add_argument('--url', default = sheet_url, help = 'sheet address; {sheet} is replaced with the sheet name')
+    parser.add_argument('--model-dir', default = None, help = "also copy the file into the model's output directory")
+    args = parser.parse_args()
+
+    table = loadParams(args.sheet_name, source = args.source, refresh = args.refresh, url = args.url)
+    writeParams(table, modelDir = args.model_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+Runs every analysis step for a TORUS output directory, instead of calling plotter.py, image_chi.py,
+vtuContourPlotter.py, sheetAppender and pngUpload.py one after another from bash.
+
+The steps and what they need:
+
+    sed_list  -> sed        find the sed_inc files, then SED chi-squared values and the SED plot (plotter.main)
+    image                   image chi-squared value and plot (image_chi.score_image)
+    lucy      -> contours   find the latest lucy file, then the contour plots (vtuContourPlotter.bigPlot)
+    sed       -> sink       queue [model, chi] for the Results sheet (sheetAppender)
+    sed, image, contours -> upload    upload the plots to Drive (pngUpload.bulkUpload)
+
+The sink row has the same shape as sheetAppender.main's: the model name and its best SED chi-squared (the lowest
+sum of the four band chis over the main inclinations). The image chi goes to results.db with the other scores.
+Rows are queued under the model name, so rerunning the sink doesn't add the model to the sheet twice, and are
+sent in one go after every directory has run.
+
+Steps whose inputs are ready run at the same time. The plotting/scoring steps run in a pool of processes
+(--cpu of them; matplotlib can't be used from several threads) and the file/network steps in a pool of
+threads (--io of them). Steps with nothing to do (no SEDs, no image, no lucy files) are skipped.
+
+Each finished step is written to .pipeline_state.json in the model directory along with what it returned.
+Running the pipeline again redoes steps that failed, haven't run or had nothing to do, so after a failure it picks
+up where it stopped. The SED and lucy files are looked for again every time, and if they have changed (e.g. the
+pipeline first ran while TORUS was still writing) the steps after them are redone too.
+--force reruns everything, --only sed,image reruns just those steps (and anything after them).
+
+python3 pipeline.py directory [directory ...]
+python3 pipeline.py directory --image directory/image.fits --no-upload --cpu 2
+
+(--image can only be given with a single directory.)
+
+Run it from the same directory as the individual scripts, since the observation files and plots are found and
+written relative to the working directory.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+state_name = '.pipeline_state.json'
+
+# name: (pool, the steps it needs)
+steps = {
+    'sed_list': ('io', ()),
+    'sed': ('cpu', ('sed_list',)),
+    'image': ('cpu', ()),
+    'lucy': ('io', ()),
+    'contours': ('cpu', ('lucy',)),
+    'sink': ('io', ('sed',)),
+    'upload': ('io', ('sed', 'image', 'contours')),
+}
+
+# steps that only look at which files are in the directory. They are cheap, so they run every time in case
+# TORUS has written more output since the last run.
+rescan = ('sed_list', 'lucy')
+
+_drive = None # (gauth, drive), logged in once and shared by every upload step
+_driveLock = threading.Lock()
+
+def modelName(directory):
+    return directory.rstrip('/').split('/')[-1]
+
+def findImage(directory):
+    """
+    The TORUS image of a model, taken to be the first .fits file in its directory. None if there isn't one.
+    """
+    fitsList = sorted(item for item in os.listdir(directory) if item.endswith('.fits'))
+    if not fitsList:
+        return None
+    return directory + '/' + fitsList[0]
+
+# The step functions all take (directory, options, inputs) where inputs holds what the steps they need returned.
+# They are at module level so they can be sent to the process pool.
+
+def sedListStep(directory, options, inputs):
+    import plotter
+    # with the modification times, so SEDs that are rewritten count as new
+    return [[SED, os.path.getmtime(os.path.join(directory, SED))] for SED in sorted(plotter.getSEDlist(directory))]
+
+def sedStep(directory, options, inputs):
+    if not inputs['sed_list']:
+        return None
+    import matplotlib
+    matplotlib.use('Agg')
+    import plotter
+
+    sedChis = plotter.main(directory)
+    return {'sedChis': sedChis, 'png': directory + '.png'}
+
+def imageStep(directory, options, inputs):
+    imagePath = options.get('image') or findImage(directory)
+    if imagePath is None:
+        return None
+    import matplotlib
+    matplotlib.use('Agg')
+    import image_chi
+
+    modelname = modelName(directory)
+    chi = image_chi.score_image(modelname, imagePath)
+    return {'chi': float(chi), 'png': modelname + '_image_chi.png'}
+
+def lucyStep(directory, options, inputs):
+    import vtuContourPlotter
+    return vtuContourPlotter.latest_lucy(directory)
+
+def contoursStep(directory, options, inputs):
+    if inputs['lucy'] is None:
+        return None
+    import matplotlib
+    matplotlib.use('Agg')
+    import vtuContourPlotter
+
+    vtuContourPlotter.bigPlot(inputs['lucy'], directory)
+    return {'png': directory + '_contour_plots.png'}
+
+def sinkStep(directory, options, inputs):
+    """
+    Only queues the row; main() flushes the journal once all the directories are done.
+    """
+    if options.get('noSink') or inputs['sed'] is None or not inputs['sed']['sedChis']:
+        return None
+    import sheetAppender
+
+    modelname = modelName(directory)
+    bestSED = min(sum(chis) for chis in inputs['sed']['sedChis'].values())
+    sheetAppender.queueRow(modelname, bestSED, key = modelname)
+    return [modelname, bestSED]
+
+def driveLogin():
+    """
+    Logs in to Drive the first time it's needed, and returns the same (gauth, drive) after that.
+    """
+    global _drive
+    with _driveLock:
+        if _drive is None:
+            import pngUpload
+            _drive = pngUpload.login()
+    return _drive
+
+def uploadStep(directory, options, inputs):
+    if options.get('noUpload'):
+        return None
+    import pngUpload
+
+    uploaded = {}
+    for step, folder in (('sed', 'SEDs'), ('image', 'Images'), ('contours', 'Contours')):
+        if inputs[step] is not None:
+            gauth, drive = driveLogin()
+            uploaded.update(pngUpload.bulkUpload([inputs[step]['png']], folder, drive = drive, gauth = gauth))
+    return uploaded
+
+stepFunctions = {
+    'sed_list': sedListStep,
+    'sed': sedStep,
+    'image': imageStep,
+    'lucy': lucyStep,
+    'contours': contoursStep,
+    'sink': sinkStep,
+    'upload': uploadStep,
+}
+
+def loadState(directory):
+    path = os.path.join(directory, state_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def saveState(directory, state):
+    import modelCache
+
+    modelCache.writeAtomic(os.path.join(directory, state_name), json.dumps(state, indent = 1))
+
+def downstream(names):
+    """
+    The given steps plus every step that depends on them, directly or not.
+    """
+    names = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for name, (pool, needs) in steps.items():
+            if name not in names and names.intersection(needs):
+                names.add(name)
+                changed = True
+    return names
+
+def run(directory, options = None, pools = None, force = False, only = None):
+    """
+    Runs the pipeline for one model directory. Returns the state: {step: {'status': 'done' or 'failed',
+    'result' or 'error': ..., 'seconds': ...}}. pools is a dictionary with 'cpu' and 'io' executors; if it is
+    None, pools are made just for this run. The sink step only queues its row, so call sheetAppender.flush()
+    afterwards to send it.
+    """
+    options = options or {}
+    if only is not None and not set(only).issubset(steps):
+        raise ValueError('unknown steps: ' + ', '.join(sorted(set(only) - set(steps))))
+    previous = {} if force else loadState(directory)
+    redo = set(rescan)
+    if only is not None:
+        redo.update(downstream(only))
+    for name, entry in previous.items():
+        if entry.get('status') != 'done' or entry.get('result') is None: # failed, or had nothing to do last time
+            redo.add(name)
+
+    ownPools = pools is None
+    if ownPools:
+        pools = makePools()
+
+    state = {}
+    try:
+        running = {}
+        failed = set()
+        changed = set() # steps that ran and whose output may differ from the last run
+        while True:
+            ready = True
+            while ready: # reusing a step's last result can make the steps after it ready straight away
+                ready = False
+                for name, (pool, needs) in steps.items():
+                    if name in state:
+                        continue
+                    if any(need in failed for need in needs):
+                        failed.add(name)
+                        state[name] = {'status': 'failed', 'error': 'skipped because a step it needs failed'}
+                        ready = True
+                        continue
+                    if not all(state.get(need, {}).get('status') == 'done' for need in needs):
+                        continue
+                    if name not in redo and name in previous and not changed.intersection(needs):
+                        state[name] = previous[name] # nothing it depends on has changed since it last ran
+                        ready = True
+                        continue
+                    inputs = {need: state[need]['result'] for need in needs}
+                    future = pools[pool].submit(stepFunctions[name], directory, options, inputs)
+                    running[future] = name
+                    state[name] = {'status': 'running', 'started': time.time()}
+
+            if not running:
+                break
+
+            finished, pending = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                seconds = time.time() - state[name]['started']
+                try:
+                    result = json.loads(json.dumps(future.result())) # as it will be read back from the state file
+                except Exception as e:
+                    failed.add(name)
+                    state[name] = {'status': 'failed', 'error': repr(e), 'seconds': seconds}
+                else:
+                    state[name] = {'status': 'done', 'result': result, 'seconds': seconds}
+                    # a rescan that found the same files changes nothing; any other step that did something made new output
+                    if result != previous.get(name, {}).get('result') or (result is not None and name not in rescan):
+                        changed.add(name)
+                saveState(directory, state) # save after every step so a crash doesn't lose finished ones
+    finally:
+        if ownPools:
+            closePools(pools)
+    saveState(directory, state)
+    return state
+
+def makePools(cpu = None, io = 4):
+    """
+    A process pool for the plotting/scoring steps and a thread pool for the file/network steps.
+    Processes are started fresh (spawn) rather than forked, since the io threads may be running.
+    """
+    import multiprocessing
+
+    return {'cpu': ProcessPoolExecutor(max_workers = cpu or os.cpu_count(), mp_context = multiprocessing.get_context('spawn')),
+            'io': ThreadPoolExecutor(max_workers = io)}
+
+def closePools(pools):
+    for pool in pools.values():
+        pool.shutdown()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Run every analysis step for TORUS model directories.')
+    parser.add_argument('directories', nargs = '+')
+    parser.add_argument('--image', default = None, help = 'TORUS image to score (default: first .fits file in the directory)')
+    parser.add_argument('--cpu', type = int, default = None, help = 'processes for plotting and scoring (default: number of CPUs)')
+    parser.add_argument('--io', type = int, default = 4, help = 'threads for reading files, the sheet and uploads')
+    parser.add_argument('--force', action = 'store_true', help = 'rerun steps that already finished')
+    parser.add_argument('--only', default = None, help = 'comma separated steps to rerun, along with the steps after them')
+    parser.add_argument('--no-sink', action = 'store_true', help = "don't send results to the sheet")
+    parser.add_argument('--no-upload', action = 'store_true', help = "don't upload the plots")
+    args = parser.parse_args()
+    if args.image is not None and len(args.directories) > 1:
+        parser.error('--image can only be used with a single directory')
+    only = None if args.only is None else args.only.split(',')
+    if only is not None and not set(only).issubset(steps):
+        parser.error('unknown steps for --only: ' + ', '.join(sorted(set(only) - set(steps))) + ' (steps are ' + ', '.join(steps) + ')')
+
+    options = {'image': args.image, 'noSink': args.no_sink, 'noUpload': args.no_upload}
+
+    pools = makePools(args.cpu, args.io)
+    anyFailed = False
+    try:
+        for directory in args.directories:
+            state = run(directory, options, pools, force = args.force, only = only)
+            for name in steps:
+                entry = state.get(name, {})
+                print('%-30s %-10s %-8s %s' % (modelName(directory), name, entry.get('status', ''), entry.get('error', '')))
+                anyFailed = anyFailed or entry.get('status') == 'failed'
+    finally:
+        closePools(pools)
+
+    if not args.no_sink:
+        import sheetAppender
+        try:
+            print(str(sheetAppender.flush()) + ' rows sent to the sheet')
+        except Exception as e:
+            print('sending to the sheet failed, the rows stay queued for the next flush: ' + repr(e), file = sys.stderr)
+            anyFailed = True
+    if anyFailed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
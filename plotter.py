@@ -3,6 +3,10 @@ import sys
 import os
 import numpy as np
 import curveFitChi
+import time
+import resultsDB
+import modelCache
+import tracing
 """
 A module to plot SEDs produced by TORUS. Plots the SED due only to scattering, the SED due only to
 thermal emission, the combined SED, and a series of observations. Also calculates the chi-squared 
@@ -94,17 +98,22 @@ def findBandMax(list, value):
     else:
         return(findBandMax(list[:-1], value))
 
-def plotData(dataPath):
+_dataCache = {} # parsed and corrected observations, reused in long-running processes (worker.py)
+
+@tracing.traced('plotter.sed_data')
+def readData(dataPath):
     """
-    Plots the observations. Trims out points with no associated error or 0 error.
-    As a note, this code tracks the source name of each point, which in most cases
-    includes the band. A more precise reddening correction would likely just use the provided 
-    bands. However, the result will likely be very similar to the result produced by the current
-    reddening function.
+    Reads the observations and applies the reddening correction. Returns a dictionary of
+    source name -> (wavelengths, corrected fluxes, errors). Trims out points with no associated error or 0 error.
+    The result is kept until the file changes, so the file is only read once per process.
     """
+    key = (os.path.abspath(dataPath), os.path.getmtime(dataPath))
+    if key in _dataCache:
+        return _dataCache[key]
 
     fullfile = open(dataPath, "r")
     textfile = fullfile.read()
+    fullfile.close()
 
     filelines = textfile.splitlines()
 
@@ -136,12 +145,12 @@ def plotData(dataPath):
         else:
             datadict[band[j]].append([lam[j], lamFlam[j], error[j]])
 
-    minY = 1
-    for key in datadict:
+    corrected = {}
+    for key2 in datadict:
         x = []
         y = []
         err = []
-        keydata = datadict[key]
+        keydata = datadict[key2]
         
         for k in range(len(keydata)):
             values = keydata[k]
@@ -151,8 +160,21 @@ def plotData(dataPath):
             correctedY = correctReddening(pointX, pointY)
             y.append(correctedY)
             err.append(values[2])
+        corrected[key2] = (x, y, err)
+
+    _dataCache[key] = corrected
+    return corrected
 
-            
+def plotData(dataPath):
+    """
+    Plots the observations.
+    As a note, this code tracks the source name of each point, which in most cases
+    includes the band. A more precise reddening correction would likely just use the provided 
+    bands. However, the result will likely be very similar to the result produced by the current
+    reddening function.
+    """
+    minY = 1
+    for key, (x, y, err) in readData(dataPath).items():
         plt.scatter(x, y, s=15, label = str(key))
         plt.errorbar(x, y, yerr = err, fmt = 'None')
         
@@ -160,6 +182,7 @@ def plotData(dataPath):
             minY = min(y)
     return minY
 
+@tracing.traced('plotter.sed_model')
 def plotModel(modelPath, minY):
     """
     A function to plot the model SEDs produced by TORUS.
@@ -221,42 +244,70 @@ def getSEDlist(directory):
 
 def main(directory):
 
+    start = time.perf_counter()
+    photPath = 'mwc275_phot_cleaned_0.dat'
+    filename = directory + '.png'
+    modelname = directory.rstrip('/').split('/')[-1]
+    paramPath = resultsDB.findParamFile(directory)
+
+    key = modelCache.cacheKey('sed_chi', paramPath, (photPath,))
+    cached = modelCache.lookup(key)
+    sedChis = {}
+    if cached is not None: # same parameters already scored
+        if cached['values'].get('model') == modelname and modelCache.restore(cached, 'sed_png', filename):
+            resultsDB.record(modelname, paramPath = paramPath, sedChis = cached['values']['sedChis'],
+                             runtimes = {'sed_chi': time.perf_counter() - start}, artifacts = {'sed_png': filename})
+            return cached['values']['sedChis']
+        sedChis = dict(cached['values']['sedChis']) # the plot has the other model's name on it, so redraw it without redoing the chis
+
     fig = plt.figure(figsize = (16,10))
-    plt.grid(False)
-    plt.suptitle(directory + " SED (olin210pa65537)", fontsize = '18', y = 0.96)
-    plt.xlabel('lambda ($\mu$m)')
-    plt.ylabel('flux (W/${m^2}$)')
+    try:
+        plt.grid(False)
+        plt.suptitle(directory + " SED (olin210pa65537)", fontsize = '18', y = 0.96)
+        plt.xlabel('lambda ($\mu$m)')
+        plt.ylabel('flux (W/${m^2}$)')
 
-    minY = plotData('mwc275_phot_cleaned_0.dat')
+        minY = plotData(photPath)
     
-    sedList = getSEDlist(directory)
-    for SED in sedList:
-        if str(SED).count('_') == 1:
-            # only interested in plotting the main 3 SEDs right now
-            mainSED = str(SED)
-        modelPath = directory + '/' + SED
-        coords = plotModel(modelPath, minY)
-        x = coords[0]
-        y = coords[1]
-        plt.plot(x,y, label = str(SED).split('.')[0])
-
-    modelPath = directory + '/' + mainSED
-    chiTuple = curveFitChi.findChi(modelPath, 'mwc275_phot_cleaned_0.dat')
-    # finding the chi-squared value using Jake's code
-
-    nearIR = "Near IR $\chi^2$: " + str(float(f'{chiTuple[0]:.2f}')) + "    "
-    midIR = "Mid IR $\chi^2$: " + str(float(f'{chiTuple[1]:.2f}')) + "    "
-    farIR = "Far IR $\chi^2$: " + str(float(f'{chiTuple[1]:.2f}')) + "    "
-    micro = "Microwave $\chi^2$: " + str(float(f'{chiTuple[3]:.2f}')) + "    "
-    allChi = nearIR + midIR + farIR + micro
-
-    plt.title(allChi)
-
-    plt.legend(fontsize = '9')
-    plt.xscale('log')
-    plt.yscale('log')
-    filename = directory + '.png'
-    plt.savefig(filename)
+        sedList = getSEDlist(directory)
+        for SED in sedList:
+            if str(SED).count('_') == 1:
+                # only interested in plotting the main 3 SEDs right now
+                mainSED = str(SED)
+                inclination = str(SED).split('.')[0].split('_inc')[-1]
+                if inclination not in sedChis: # already known on a cache hit
+                    with tracing.stage('plotter.sed_chi', inclination = inclination):
+                        sedChis[inclination] = [float(c) for c in curveFitChi.findChi(directory + '/' + mainSED, photPath)[:4]]
+            modelPath = directory + '/' + SED
+            coords = plotModel(modelPath, minY)
+            x = coords[0]
+            y = coords[1]
+            plt.plot(x,y, label = str(SED).split('.')[0])
+
+        modelPath = directory + '/' + mainSED
+        chiTuple = sedChis[str(mainSED).split('.')[0].split('_inc')[-1]]
+        # finding the chi-squared value using Jake's code (done for every inclination above)
+
+        nearIR = "Near IR $\chi^2$: " + str(float(f'{chiTuple[0]:.2f}')) + "    "
+        midIR = "Mid IR $\chi^2$: " + str(float(f'{chiTuple[1]:.2f}')) + "    "
+        farIR = "Far IR $\chi^2$: " + str(float(f'{chiTuple[2]:.2f}')) + "    "
+        micro = "Microwave $\chi^2$: " + str(float(f'{chiTuple[3]:.2f}')) + "    "
+        allChi = nearIR + midIR + farIR + micro
+
+        plt.title(allChi)
+
+        plt.legend(fontsize = '9')
+        plt.xscale('log')
+        plt.yscale('log')
+        with tracing.stage('plotter.render', path = filename):
+            plt.savefig(filename)
+    finally:
+        plt.close(fig) # even if a chi or plot fails, so a long-running worker doesn't pile up figures
+
+    modelCache.store(key, {'sedChis': sedChis, 'model': modelname}, {'sed_png': filename})
+    resultsDB.record(modelname, paramPath = paramPath, sedChis = sedChis,
+                     runtimes = {'sed_chi': time.perf_counter() - start}, artifacts = {'sed_png': filename})
+    return sedChis
 
 if __name__ == '__main__':
     directory = str(sys.argv[1])
@@ -1,38 +1,163 @@
 """
 Uploads images produced by other programs to folders in my Google Drive.
+
+Ways to run the module:
+
+python3 pngUpload.py file folder
+--  uploads one file. folder is SEDs, Contours, or Images.
+
+python3 pngUpload.py --bulk folder path [path ...]
+--  uploads many files at once. Each path can be a file or a directory (every .png in the directory
+    is uploaded). Uses one login for all of the files and uploads several at a time. Files whose
+    contents have already been uploaded to that folder (tracked in upload_manifest.json) are skipped.
+
+import pngUpload
+pngUpload.bulkUpload(paths, folder, drive = drive)
+--  drive can be anything with a CreateFile method that behaves like pydrive's GoogleDrive,
+    e.g. a local stand-in for testing.
 """
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
+import json
 import os
-import sys
-
-uploadFile = str(sys.argv[1])
-
-folder = str(sys.argv[2])
-
-if folder == 'SEDs':
-    folderPath = '1p0pY3lRDMwjC1l45dDilrAfNQbdZ6OaZ'
-if folder == 'Contours':
-    folderPath = '1NLDl8hBk0mPldWOexq2wymRM2t_DjPW6'
-if folder == 'Images':
-    folderPath = '1PCvCOnmhBR13AAL45B9GlC0sHl9OYKft'
-
-
-gauth = GoogleAuth()
-gauth.LoadCredentialsFile("credentials.json")
-if gauth.credentials is None:
-	gauth.LocalWebserverAuth()
-elif gauth.access_token_expired:
-	gauth.Refresh()
-else:
-	gauth.Authorize()
-gauth.SaveCredentialsFile("credentials.json")
-
-drive = GoogleDrive(gauth)
-filetitle = uploadFile.split("/")[-1]
-
-gfile = drive.CreateFile({'parents': [{'id': folderPath}]})
-gfile.SetContentFile(uploadFile)
-gfile.Upload()
-gfile['title'] = filetitle
-gfile.Upload()
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import modelCache
+import tracing
+
+folderIds = {
+    'SEDs': '1p0pY3lRDMwjC1l45dDilrAfNQbdZ6OaZ',
+    'Contours': '1NLDl8hBk0mPldWOexq2wymRM2t_DjPW6',
+    'Images': '1PCvCOnmhBR13AAL45B9GlC0sHl9OYKft'
+}
+
+manifest_path = 'upload_manifest.json'
+
+def getFolderId(folder):
+    """
+    Looks up the Drive id of one of my folders by name.
+    """
+    if folder not in folderIds:
+        raise ValueError('unknown folder ' + repr(folder) + '! accepted values: ' + ', '.join(folderIds))
+    return folderIds[folder]
+
+@tracing.traced('upload.login')
+def login(credentialsPath = "credentials.json"):
+    """
+    Loads (and refreshes if needed) the OAuth credentials and returns (gauth, drive).
+    """
+    from pydrive.auth import GoogleAuth
+    from pydrive.drive import GoogleDrive
+
+    gauth = GoogleAuth()
+    gauth.LoadCredentialsFile(credentialsPath)
+    if gauth.credentials is None:
+        gauth.LocalWebserverAuth()
+    elif gauth.access_token_expired:
+        gauth.Refresh()
+    else:
+        gauth.Authorize()
+    gauth.SaveCredentialsFile(credentialsPath)
+
+    return gauth, GoogleDrive(gauth)
+
+def loadManifest(path = manifest_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def saveManifest(manifest, path = manifest_path):
+    modelCache.writeAtomic(path, json.dumps(manifest, indent = 1, sort_keys = True))
+
+def expandPaths(paths, extension = '.png'):
+    """
+    Turns a list of files and directories into a sorted list of files. Directories contribute the
+    files directly inside them that end with extension.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for item in sorted(os.listdir(path)):
+                full = os.path.join(path, item)
+                if item.endswith(extension) and os.path.isfile(full):
+                    files.append(full)
+        else:
+            files.append(path)
+    return files
+
+@tracing.traced('upload.file')
+def uploadFile(drive, uploadPath, folderId, http = None):
+    """
+    Uploads one file with its title already set, so it only goes up once. Returns the Drive file id.
+    """
+    filetitle = os.path.basename(uploadPath)
+    gfile = drive.CreateFile({'title': filetitle, 'parents': [{'id': folderId}]})
+    gfile.SetContentFile(uploadPath)
+    if http is None:
+        gfile.Upload()
+    else:
+        gfile.Upload(param = {'http': http})
+    return gfile.get('id')
+
+def bulkUpload(paths, folder, drive = None, gauth = None, workers = 4, manifestPath = manifest_path):
+    """
+    Uploads every file in paths (files or directories) to folder, several at a time.
+    Files already in the manifest for that folder are skipped. Returns a dictionary of
+    path -> Drive id for the files that were uploaded.
+    """
+    folderId = getFolderId(folder)
+    if drive is None:
+        gauth, drive = login()
+
+    manifest = loadManifest(manifestPath)
+    todo = []
+    seen = set()
+    for path in expandPaths(paths):
+        with tracing.stage('upload.hash'):
+            key = folderId + ':' + modelCache.fileHash(path)
+        if key in manifest or key in seen: # already uploaded, or a duplicate within this batch
+            continue
+        seen.add(key)
+        todo.append((path, key))
+
+    # httplib2 connections aren't thread-safe, so each thread gets its own from the shared login
+    local = threading.local()
+    def work(path):
+        http = None
+        if gauth is not None and hasattr(gauth, 'Get_Http_Object'):
+            if not hasattr(local, 'http'):
+                local.http = gauth.Get_Http_Object()
+            http = local.http
+        return uploadFile(drive, path, folderId, http)
+
+    uploaded = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(work, path): (path, key) for path, key in todo}
+        for future in as_completed(futures):
+            path, key = futures[future]
+            try:
+                fileId = future.result()
+            except Exception as e:
+                errors.append((path, e))
+                continue
+            uploaded[path] = fileId
+            manifest[key] = {'title': os.path.basename(path), 'id': fileId}
+            saveManifest(manifest, manifestPath) # save as we go so a crash doesn't lose finished uploads
+
+    if errors:
+        raise RuntimeError(str(len(errors)) + ' uploads failed: ' + ', '.join(path for path, e in errors)) from errors[0][1]
+    return uploaded
+
+def main():
+    import sys
+
+    if sys.argv[1] == '--bulk':
+        uploaded = bulkUpload(sys.argv[3:], str(sys.argv[2]))
+        print(str(len(uploaded)) + ' files uploaded')
+    else:
+        folderId = getFolderId(str(sys.argv[2]))
+        gauth, drive = login()
+        uploadFile(drive, str(sys.argv[1]), folderId)
+
+if __name__ == '__main__':
+    main()
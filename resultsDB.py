@@ -0,0 +1,223 @@
+"""
+A local SQLite database (results.db) that collects the scores for each model in one place, instead of
+having them spread across png titles and the Results sheet.
+
+Models are keyed by model name and the sha256 of the parameters file they were run with, so two runs
+with the same name but different parameters don't overwrite each other. For each model it stores:
+    - the image chi-squared (image_chi.py)
+    - the near IR, mid IR, far IR and microwave SED chi-squared values for each inclination (plotter.py)
+    - how long each step took
+    - the paths of the plots that were made
+    - the values in the parameters file, so models can be filtered on them
+
+Everything for one call to record() (or recordMany()) is written in a single transaction.
+
+import resultsDB
+resultsDB.topModels(10)                          # 10 lowest image chi models
+resultsDB.topModels(10, by = 'total', inclination = '042')   # 10 lowest summed SED chi at one inclination
+resultsDB.paramRange('mdisc', 1e-4, 1e-2)        # models with 1e-4 <= mdisc <= 1e-2
+"""
+import os
+import sqlite3
+import time
+
+import modelCache
+
+db_path = 'results.db'
+
+schema = """
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    param_path TEXT,
+    image_chi REAL,
+    updated REAL,
+    PRIMARY KEY (model, param_hash)
+);
+CREATE INDEX IF NOT EXISTS models_image_chi ON models (image_chi);
+CREATE INDEX IF NOT EXISTS models_param_hash ON models (param_hash);
+
+CREATE TABLE IF NOT EXISTS sed_chi (
+    model TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    inclination TEXT NOT NULL,
+    near_ir REAL,
+    mid_ir REAL,
+    far_ir REAL,
+    microwave REAL,
+    total REAL,
+    PRIMARY KEY (model, param_hash, inclination)
+);
+CREATE INDEX IF NOT EXISTS sed_chi_total ON sed_chi (inclination, total);
+
+CREATE TABLE IF NOT EXISTS params (
+    model TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    text TEXT,
+    PRIMARY KEY (model, param_hash, name)
+);
+CREATE INDEX IF NOT EXISTS params_name_value ON params (name, value);
+
+CREATE TABLE IF NOT EXISTS runtimes (
+    model TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL,
+    PRIMARY KEY (model, param_hash, stage)
+);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    model TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT,
+    PRIMARY KEY (model, param_hash, kind)
+);
+"""
+
+sedBands = ('near_ir', 'mid_ir', 'far_ir', 'microwave')
+
+def connect(path = db_path):
+    """
+    Opens the results database, creating the tables if they don't exist yet.
+    """
+    con = sqlite3.connect(path, timeout = 60)
+    con.executescript(schema)
+    return con
+
+def paramHash(paramPath):
+    """
+    sha256 of a parameters file. Models without a known parameters file get an empty hash.
+    """
+    if paramPath is None or not os.path.exists(paramPath):
+        return ''
+    return modelCache.fileHash(paramPath)
+
+def findParamFile(directory):
+    """
+    Returns the parameters file (modParametersNEW.dat, copied there by paramWriter.py --model-dir) inside the
+    model directory, or None if the model directory doesn't have its own copy. The working directory is deliberately not
+    searched: the copy there belongs to whichever model was set up last, not necessarily this one.
+    """
+    if not directory:
+        return None
+    path = os.path.join(directory, 'modParametersNEW.dat')
+    if os.path.exists(path):
+        return path
+    return None
+
+def readParamFile(paramPath):
+    """
+    Reads a TORUS parameters file into a dictionary of name -> value string. Uses the same
+    'name value ...' layout that paramWriter.py edits.
+    """
+    params = {}
+    if paramPath is None or not os.path.exists(paramPath):
+        return params
+    with open(paramPath, 'r') as f:
+        for line in f:
+            entries = line.split()
+            if len(entries) >= 2 and not entries[0].startswith(('!', '#', '%')):
+                params.setdefault(entries[0], entries[1])
+    return params
+
+def _toFloat(text):
+    try:
+        return float(str(text).lower().replace('d', 'e')) # fortran style 1.0d-3
+    except ValueError:
+        return None
+
+def _write(con, rec):
+    model = str(rec['model'])
+    paramPath = rec.get('paramPath')
+    pHash = rec.get('paramHash')
+    if pHash is None:
+        pHash = paramHash(paramPath)
+    key = (model, pHash)
+
+    con.execute('INSERT INTO models (model, param_hash, param_path, updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (model, param_hash) DO UPDATE SET updated = excluded.updated, '
+                'param_path = COALESCE(excluded.param_path, param_path)',
+                key + (paramPath, time.time()))
+
+    if rec.get('imageChi') is not None:
+        con.execute('UPDATE models SET image_chi = ? WHERE model = ? AND param_hash = ?',
+                    (float(rec['imageChi']),) + key)
+
+    sedRows = []
+    for inclination, chis in (rec.get('sedChis') or {}).items():
+        chis = [float(c) for c in chis]
+        sedRows.append(key + (str(inclination),) + tuple(chis) + (sum(chis),))
+    con.executemany('INSERT OR REPLACE INTO sed_chi VALUES (?, ?, ?, ?, ?, ?, ?, ?)', sedRows)
+
+    paramRows = [key + (name, _toFloat(value), str(value)) for name, value in readParamFile(paramPath).items()]
+    con.executemany('INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?, ?)', paramRows)
+
+    con.executemany('INSERT OR REPLACE INTO runtimes VALUES (?, ?, ?, ?)',
+                    [key + (stage, float(seconds)) for stage, seconds in (rec.get('runtimes') or {}).items()])
+    con.executemany('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)',
+                    [key + (kind, str(path)) for kind, path in (rec.get('artifacts') or {}).items()])
+
+def recordMany(records, path = db_path):
+    """
+    Writes a list of results in one transaction. Each result is a dictionary with a 'model' key and
+    any of: paramPath, paramHash, imageChi, sedChis ({inclination: (near IR, mid IR, far IR, microwave)}),
+    runtimes ({stage: seconds}), artifacts ({kind: path}).
+    Values that aren't given are left as they were, so the image and SED scores can be written separately.
+    """
+    con = connect(path)
+    try:
+        with con:
+            for rec in records:
+                _write(con, rec)
+    finally:
+        con.close()
+
+def record(model, paramPath = None, imageChi = None, sedChis = None, runtimes = None, artifacts = None, path = db_path):
+    """
+    Writes the results for one model. See recordMany.
+    """
+    recordMany([{'model': model, 'paramPath': paramPath, 'imageChi': imageChi, 'sedChis': sedChis,
+                 'runtimes': runtimes, 'artifacts': artifacts}], path)
+
+def topModels(k = 10, by = 'image_chi', inclination = None, path = db_path):
+    """
+    Returns the k models with the lowest chi as (model, param_hash, chi) tuples. by is 'image_chi',
+    or one of 'near_ir', 'mid_ir', 'far_ir', 'microwave', 'total' for the SED chis. For the SED chis,
+    inclination picks one inclination; otherwise the best inclination of each model is used.
+    """
+    con = connect(path)
+    try:
+        if by == 'image_chi':
+            return con.execute('SELECT model, param_hash, image_chi FROM models WHERE image_chi IS NOT NULL '
+                               'ORDER BY image_chi LIMIT ?', (k,)).fetchall()
+        if by not in sedBands + ('total',):
+            raise ValueError('cannot rank by ' + repr(by))
+        if inclination is not None:
+            return con.execute('SELECT model, param_hash, ' + by + ' FROM sed_chi WHERE inclination = ? '
+                               'ORDER BY ' + by + ' LIMIT ?', (str(inclination), k)).fetchall()
+        return con.execute('SELECT model, param_hash, MIN(' + by + ') AS chi FROM sed_chi '
+                           'GROUP BY model, param_hash ORDER BY chi LIMIT ?', (k,)).fetchall()
+    finally:
+        con.close()
+
+def paramRange(name, low = None, high = None, path = db_path):
+    """
+    Returns (model, param_hash, value) for models whose numeric parameter name is between low and high
+    (inclusive). Either end can be None to leave it open.
+    """
+    query = 'SELECT model, param_hash, value FROM params WHERE name = ? AND value IS NOT NULL'
+    args = [name]
+    if low is not None:
+        query += ' AND value >= ?'
+        args.append(low)
+    if high is not None:
+        query += ' AND value <= ?'
+        args.append(high)
+    con = connect(path)
+    try:
+        return con.execute(query + ' ORDER BY value', args).fetchall()
+    finally:
+        con.close()
@@ -1,24 +1,213 @@
 """
 Program that writes the SED chi-squared value to a spreadsheet in my Google Drive.
+
+Rows are not sent one at a time. They are first written to a local journal (results_journal.db, a small
+SQLite file) and then sent to the sheet in batches, one values_append call per batch. Anything that
+hasn't been sent yet stays in the journal, so if the upload fails or the process is killed the rows
+go out with the next flush instead of being lost.
+
+main(modelname, chival) keeps the old behaviour of appending a row right away. To save up rows from
+several models and send them together, call queueRow() for each and flush() once at the end, or run
+
+python3 sheetAppender.py --flush
+
+Rows can be queued with a key (e.g. the model name) so that queueing the same result twice, say when a pipeline
+step is rerun, doesn't add a second row to the sheet: a keyed row that is already waiting, or was already sent with
+the same values, is not queued again, and a newer row for the same key replaces one that hasn't been sent yet.
+
+Anything with a values_append method can be passed as spreadsheet= to flush(), e.g. a fake for testing.
 """
-def main(modelname, chival):
-    import gspread
-    from pydrive.auth import GoogleAuth
-    from pydrive.drive import GoogleDrive
-    from google.oauth2.service_account import Credentials
+import json
+import sqlite3
+import time
+import tracing
+
+sheet_key = '1BuyxFfV0C_RqYA_5UKN6eLL2XMXL2SHtLsfW-oIPg88' # whatever the spreadsheet key is (needs to be set to public edit)
+journal_path = 'results_journal.db'
+
+_spreadsheets = {} # authorized spreadsheets, so the credentials are only loaded once per process
+
+def openSpreadsheet(key = sheet_key, keyFile = 'client_key.json'):
+    """
+    Authorizes with the service account and opens the spreadsheet. Only done once per key.
+    """
+    if key not in _spreadsheets:
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        scopes = ['https://www.googleapis.com/auth/spreadsheets',
+                  'https://www.googleapis.com/auth/drive']
+        credentials = Credentials.from_service_account_file(keyFile, scopes=scopes) # using existing creds file
 
-    scopes = ['https://www.googleapis.com/auth/spreadsheets',
-              'https://www.googleapis.com/auth/drive']
-    credentials = Credentials.from_service_account_file('client_key.json', scopes=scopes) # using existing creds file
+        gc = gspread.authorize(credentials) # authorize program to do things
+        _spreadsheets[key] = gc.open_by_key(key)
+    return _spreadsheets[key]
 
-    gc = gspread.authorize(credentials) # authorize program to do things
+def openJournal(path = journal_path):
+    """
+    Opens (and creates if needed) the journal of rows waiting to be sent.
+    """
+    con = sqlite3.connect(path, timeout = 60)
+    con.execute('CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT NOT NULL, row TEXT NOT NULL, '
+                'claimed REAL, claimant TEXT, key TEXT)')
+    # the last row sent for each key, so a keyed row isn't sent twice
+    con.execute('CREATE TABLE IF NOT EXISTS sent (sheet TEXT NOT NULL, key TEXT NOT NULL, row TEXT NOT NULL, sent REAL, '
+                'PRIMARY KEY (sheet, key))')
+    con.execute('CREATE INDEX IF NOT EXISTS pending_key ON pending (sheet, key)')
+    con.commit()
+    return con
 
-    gauth = GoogleAuth()
-    drive = GoogleDrive(gauth)
+def _queueKeyed(con, sheetName, key, row):
+    """
+    Queues one keyed row unless the same row is already waiting or was the last one sent for key.
+    Returns whether it was queued.
+    """
+    last = con.execute('SELECT row FROM sent WHERE sheet = ? AND key = ?', (sheetName, key)).fetchone()
+    if last is not None and last[0] == row:
+        return False
+    if con.execute('SELECT 1 FROM pending WHERE sheet = ? AND key = ? AND row = ?', (sheetName, key, row)).fetchone():
+        return False
+    # an older row for the key that nobody is sending yet is out of date
+    con.execute('DELETE FROM pending WHERE sheet = ? AND key = ? AND claimed IS NULL', (sheetName, key))
+    con.execute('INSERT INTO pending (sheet, row, key) VALUES (?, ?, ?)', (sheetName, row, key))
+    return True
+
+def queueRows(rows, sheetName = 'Results', path = journal_path, keys = None):
+    """
+    Adds rows (lists of values) to the journal without sending them. keys, if given, has one key (or None)
+    for each row; see the top of the file. Returns the number of rows queued.
+    """
+    keys = keys or [None] * len(rows)
+    con = openJournal(path)
+    try:
+        con.execute('BEGIN IMMEDIATE') # so two processes can't both decide a key still needs queueing
+        try:
+            queued = 0
+            for row, key in zip(rows, keys):
+                row = json.dumps(list(row))
+                if key is None:
+                    con.execute('INSERT INTO pending (sheet, row) VALUES (?, ?)', (sheetName, row))
+                    queued += 1
+                else:
+                    queued += _queueKeyed(con, sheetName, str(key), row)
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+    finally:
+        con.close()
+    return queued
+
+def queueRow(modelname, chival, sheetName = 'Results', path = journal_path, key = None):
+    """
+    Adds one model's result to the journal without sending it. Returns whether it was queued.
+    """
+    return queueRows([[modelname, float(chival)]], sheetName, path, [key]) == 1
+
+def pendingCount(path = journal_path):
+    """
+    Number of rows in the journal that haven't been sent yet.
+    """
+    con = openJournal(path)
+    try:
+        return con.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+    finally:
+        con.close()
+
+def _appendWithRetry(spreadsheet, sheetName, values, retries, backoff):
+    """
+    One values_append call, retried with exponential backoff (backoff, 2*backoff, 4*backoff, ... seconds).
+    """
+    for attempt in range(retries + 1):
+        try:
+            with tracing.stage('sheet.append', rows = len(values), attempt = attempt):
+                spreadsheet.values_append(sheetName, {'valueInputOption': 'RAW'}, {'values': values}) # append to the sheet
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def _claimBatch(con, batchSize, claimant, claimTimeout):
+    """
+    Marks the next batch of unclaimed rows as being sent by claimant and returns (sheet, ids, values),
+    or None if there is nothing left. Claims older than claimTimeout seconds (from a flush that died) are
+    taken over. The journal is only locked for the claim itself, not while the rows are being sent.
+    """
+    now = time.time()
+    con.execute('BEGIN IMMEDIATE')
+    try:
+        # a batch only goes to one sheet, and stops at the next row for a different sheet to keep the order
+        batch = con.execute('SELECT id, sheet, row FROM pending WHERE claimed IS NULL OR claimed < ? ORDER BY id LIMIT ?',
+                            (now - claimTimeout, batchSize)).fetchall()
+        if not batch:
+            con.rollback()
+            return None
+        sheetName = batch[0][1]
+        ids = []
+        values = []
+        for rowId, rowSheet, row in batch:
+            if rowSheet != sheetName:
+                break
+            ids.append(rowId)
+            values.append(json.loads(row))
+        con.executemany('UPDATE pending SET claimed = ?, claimant = ? WHERE id = ?', [(now, claimant, rowId) for rowId in ids])
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    return sheetName, ids, values
+
+def flush(spreadsheet = None, path = journal_path, batchSize = 500, retries = 5, backoff = 1.0, claimTimeout = 600):
+    """
+    Sends everything in the journal to the sheet, batchSize rows per values_append call.
+    Returns the number of rows sent. If a batch still fails after the retries, the error is raised and
+    that batch (and everything after it) stays in the journal for next time.
+    Each batch is claimed before it is sent so two processes flushing at once don't send the same rows,
+    and rows can still be queued while a batch is being sent or retried. The sheet is only opened (and the
+    credentials loaded) if there is something to send.
+    """
+    import uuid
+
+    claimant = uuid.uuid4().hex
+    sent = 0
+    con = openJournal(path)
+    try:
+        while True:
+            claim = _claimBatch(con, batchSize, claimant, claimTimeout)
+            if claim is None:
+                break
+            sheetName, ids, values = claim
+            try:
+                if spreadsheet is None: # only authorize once there is something to send
+                    with tracing.stage('sheet.authorize'):
+                        spreadsheet = openSpreadsheet()
+                _appendWithRetry(spreadsheet, sheetName, values, retries, backoff)
+            except BaseException:
+                with con: # give the rows back for the next flush
+                    con.executemany('UPDATE pending SET claimed = NULL, claimant = NULL WHERE id = ? AND claimant = ?',
+                                    [(rowId, claimant) for rowId in ids])
+                raise
+            with con:
+                con.executemany('INSERT OR REPLACE INTO sent (sheet, key, row, sent) SELECT sheet, key, row, ? FROM pending '
+                                'WHERE id = ? AND claimant = ? AND key IS NOT NULL', [(time.time(), rowId, claimant) for rowId in ids])
+                con.executemany('DELETE FROM pending WHERE id = ? AND claimant = ?', [(rowId, claimant) for rowId in ids])
+            sent += len(ids)
+    finally:
+        con.close()
+    return sent
+
+def main(modelname, chival):
+    """
+    Appends one row to the Results sheet, along with anything left in the journal from earlier runs.
+    """
+    queueRow(modelname, chival)
+    flush()
 
-    gs = gc.open_by_key('1BuyxFfV0C_RqYA_5UKN6eLL2XMXL2SHtLsfW-oIPg88') # whatever the spreadsheet key is (needs to be set to public edit)
+if __name__ == '__main__':
+    import sys
 
-    results = gs.worksheet('Results') # needs to have a sheet called Results -- I think this line is redundant
-    chival = float(chival)
-    vals = [[modelname, chival]]
-    gs.values_append('Results', {'valueInputOption': 'RAW'}, {'values': vals}) # append to the sheet
+    if sys.argv[1] == '--flush':
+        print(str(flush()) + ' rows sent')
+    else:
+        main(str(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,61 @@
+"""
+Tests for modelCache.
+"""
+import modelCache
+import resultsDB
+
+def makeModel(tmp_path, name, params = None):
+    directory = tmp_path / name
+    directory.mkdir()
+    if params is not None:
+        (directory / 'modParametersNEW.dat').write_text(params)
+    return str(directory)
+
+def test_models_without_their_own_param_file_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'modParametersNEW.dat').write_text('mdisc 0.1\n') # shared copy from the last paramWriter run
+    (tmp_path / 'phot.dat').write_text('photometry')
+    a = makeModel(tmp_path, 'modelA')
+    b = makeModel(tmp_path, 'modelB')
+
+    assert modelCache.cacheKey('sed_chi', resultsDB.findParamFile(a), ('phot.dat',)) is None
+    assert modelCache.cacheKey('sed_chi', resultsDB.findParamFile(b), ('phot.dat',)) is None
+
+def test_keys_follow_the_model_param_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'phot.dat').write_text('photometry')
+    a = makeModel(tmp_path, 'modelA', 'mdisc 0.1\n')
+    b = makeModel(tmp_path, 'modelB', 'mdisc 0.2\n')
+    copy = makeModel(tmp_path, 'copyOfA', 'mdisc 0.1\n')
+
+    keyA = modelCache.cacheKey('sed_chi', resultsDB.findParamFile(a), ('phot.dat',))
+    assert keyA != modelCache.cacheKey('sed_chi', resultsDB.findParamFile(b), ('phot.dat',))
+    assert keyA == modelCache.cacheKey('sed_chi', resultsDB.findParamFile(copy), ('phot.dat',))
+    assert keyA != modelCache.cacheKey('image_chi', resultsDB.findParamFile(a), ('phot.dat',))
+
+    (tmp_path / 'phot.dat').write_text('new photometry')
+    assert keyA != modelCache.cacheKey('sed_chi', resultsDB.findParamFile(a), ('phot.dat',))
+
+def test_store_lookup_restore_evict(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'plot.png').write_bytes(b'png')
+    key = modelCache.cacheKey('image_chi', makeModel(tmp_path, 'm', 'x 1\n') + '/modParametersNEW.dat')
+    assert modelCache.lookup(key) is None
+
+    modelCache.store(key, {'chi': 1.0}, {'png': 'plot.png'})
+    modelCache.store(key, {'chi': 2.0}, {'png': 'plot.png'}) # first one wins
+    entry = modelCache.lookup(key)
+    assert entry['values'] == {'chi': 1.0}
+    assert modelCache.restore(entry, 'png', 'restored.png')
+    assert (tmp_path / 'restored.png').read_bytes() == b'png'
+
+    assert modelCache.evict(maxEntries = 0) == 1
+    assert modelCache.lookup(key) is None
+    assert not modelCache.restore(entry, 'png', 'again.png')
+
+def test_writeAtomic_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / 'state.json')
+    modelCache.writeAtomic(path, '{"a": 1}')
+    modelCache.writeAtomic(path, '{"a": 2}')
+    assert (tmp_path / 'state.json').read_text() == '{"a": 2}'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['state.json']
@@ -0,0 +1,99 @@
+"""
+Tests for paramWriter, using a local http.server in place of the Google sheet.
+"""
+import functools
+import http.server
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+import paramWriter
+
+sheetCSV = '"Parameter ","Value "\n"nphot","2e5"\n"nphotimage","1000.0"\n"mdisc","0.01"\n"mdisc","99"\n'
+defaults = 'nphot 100\nnphotimage 50 ! comment\nmdisc 1.0\nrinner 0.1\n'
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'modParameters.dat').write_text(defaults)
+    return tmp_path
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    Serves <name>.csv files from a directory, standing in for the gviz CSV export.
+    """
+    served = tmp_path / 'served'
+    served.mkdir()
+    (served / 'tab1.csv').write_text(sheetCSV)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory = str(served))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+    yield httpd, 'http://127.0.0.1:' + str(httpd.server_address[1]) + '/{sheet}.csv'
+    httpd.shutdown()
+    httpd.server_close()
+
+def outputLines(workdir):
+    return (workdir / 'modParametersNEW.dat').read_text().splitlines()
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['paramWriter.py'] + list(args))
+    paramWriter.main()
+
+def test_refresh_writes_cache_and_later_runs_work_offline(workdir, server, monkeypatch):
+    httpd, url = server
+    run(monkeypatch, 'tab1', '--refresh', '--url', url)
+    assert (workdir / '.sheet_cache' / 'tab1.csv').read_text() == sheetCSV
+    assert outputLines(workdir)[0] == 'nphot 200000 '
+
+    httpd.shutdown() # no network from here on
+    httpd.server_close()
+    os.remove(workdir / 'modParametersNEW.dat')
+    run(monkeypatch, 'tab1', '--url', url)
+    assert outputLines(workdir) == ['nphot 200000 ', 'nphotimage 1000 ! comment ', 'mdisc 0.01 ', 'rinner 0.1 ']
+
+def test_missing_cache_without_network_fails(workdir, server):
+    httpd, url = server
+    httpd.shutdown()
+    httpd.server_close()
+    with pytest.raises(OSError):
+        paramWriter.loadParams('tab1', url = url)
+    assert not os.path.exists(workdir / '.sheet_cache' / 'tab1.csv')
+
+def test_csv_source(workdir):
+    (workdir / 'params.csv').write_text(sheetCSV)
+    table = paramWriter.loadParams('ignored', source = 'params.csv')
+    assert table == {'nphot': '2e5', 'nphotimage': '1000.0', 'mdisc': '0.01'} # first entry wins
+    paramWriter.writeParams(table)
+    assert outputLines(workdir) == ['nphot 200000 ', 'nphotimage 1000 ! comment ', 'mdisc 0.01 ', 'rinner 0.1 ']
+
+def test_sqlite_source(workdir):
+    con = sqlite3.connect(str(workdir / 'params.db'))
+    con.execute('CREATE TABLE tab1 (Parameter TEXT, Value)')
+    con.executemany('INSERT INTO tab1 VALUES (?, ?)', [('nphot', 300000.0), ('rinner', '0.2')])
+    con.commit()
+    con.close()
+
+    paramWriter.writeParams(paramWriter.loadParams('tab1', source = 'params.db'))
+    assert outputLines(workdir) == ['nphot 300000 ', 'nphotimage 50 ! comment ', 'mdisc 1.0 ', 'rinner 0.2 ']
+
+def test_model_dir_copy_keys_the_cache(workdir, monkeypatch):
+    import modelCache
+    import resultsDB
+
+    (workdir / 'params.csv').write_text(sheetCSV)
+    (workdir / 'phot.dat').write_text('photometry')
+    run(monkeypatch, 'tab1', '--source', 'params.csv', '--model-dir', 'runs/modelA')
+    assert (workdir / 'runs' / 'modelA' / 'modParametersNEW.dat').read_text() == (workdir / 'modParametersNEW.dat').read_text()
+
+    (workdir / 'params.csv').write_text(sheetCSV.replace('0.01', '0.02'))
+    run(monkeypatch, 'tab1', '--source', 'params.csv', '--model-dir', 'runs/modelB')
+
+    keyA = modelCache.cacheKey('sed_chi', resultsDB.findParamFile('runs/modelA'), ('phot.dat',))
+    keyB = modelCache.cacheKey('sed_chi', resultsDB.findParamFile('runs/modelB'), ('phot.dat',))
+    assert keyA is not None and keyB is not None and keyA != keyB
+    assert resultsDB.paramHash(resultsDB.findParamFile('runs/modelA')) != ''
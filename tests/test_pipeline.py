@@ -0,0 +1,137 @@
+"""
+Tests for the pipeline scheduler, sink and upload steps, with the real steps replaced by fakes and thread pools
+in place of the process pool.
+"""
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipeline
+import sheetAppender
+
+@pytest.fixture
+def pools():
+    pools = {'cpu': ThreadPoolExecutor(2), 'io': ThreadPoolExecutor(2)}
+    yield pools
+    pipeline.closePools(pools)
+
+@pytest.fixture
+def fakeSteps(monkeypatch):
+    """
+    Replaces every step with one that records its call and returns its name (or what results has for it),
+    except those set to fail.
+    """
+    calls = []
+    failing = set()
+    results = {}
+    lock = threading.Lock()
+    for name in pipeline.steps:
+        def step(directory, options, inputs, name = name):
+            with lock:
+                calls.append((name, sorted(inputs)))
+            if name in failing:
+                raise RuntimeError(name + ' broke')
+            return results.get(name, name)
+        monkeypatch.setitem(pipeline.stepFunctions, name, step)
+    return calls, failing, results
+
+def test_steps_run_after_what_they_need(tmp_path, pools, fakeSteps):
+    calls, failing, results = fakeSteps
+    state = pipeline.run(str(tmp_path), pools = pools)
+    assert all(entry['status'] == 'done' for entry in state.values())
+    order = [name for name, inputs in calls]
+    for name, (pool, needs) in pipeline.steps.items():
+        assert order.count(name) == 1
+        assert all(order.index(need) < order.index(name) for need in needs)
+    assert dict(calls)['upload'] == ['contours', 'image', 'sed']
+
+def test_rerun_picks_up_after_failure(tmp_path, pools, fakeSteps):
+    calls, failing, results = fakeSteps
+    failing.add('lucy')
+    state = pipeline.run(str(tmp_path), pools = pools)
+    assert state['lucy']['status'] == 'failed'
+    assert state['contours']['status'] == 'failed' and state['upload']['status'] == 'failed'
+    assert state['sink']['status'] == 'done'
+
+    failing.clear()
+    del calls[:]
+    state = pipeline.run(str(tmp_path), pools = pools)
+    assert sorted(name for name, inputs in calls) == ['contours', 'lucy', 'sed_list', 'upload']
+    with open(os.path.join(str(tmp_path), pipeline.state_name)) as f:
+        assert json.load(f)['upload']['status'] == 'done'
+
+def test_only_reruns_downstream(tmp_path, pools, fakeSteps):
+    calls, failing, results = fakeSteps
+    pipeline.run(str(tmp_path), pools = pools)
+    del calls[:]
+    pipeline.run(str(tmp_path), pools = pools, only = ['image'])
+    assert sorted(name for name, inputs in calls) == ['image', 'lucy', 'sed_list', 'upload'] # the rescans always run
+
+def test_new_files_redo_the_steps_after_them(tmp_path, pools, fakeSteps):
+    calls, failing, results = fakeSteps
+    results['lucy'] = 'lucy_3.vtu'
+    pipeline.run(str(tmp_path), pools = pools)
+    del calls[:]
+    pipeline.run(str(tmp_path), pools = pools) # nothing new
+    assert sorted(name for name, inputs in calls) == ['lucy', 'sed_list']
+
+    del calls[:]
+    results['lucy'] = 'lucy_7.vtu' # TORUS wrote more since the last run
+    state = pipeline.run(str(tmp_path), pools = pools)
+    assert sorted(name for name, inputs in calls) == ['contours', 'lucy', 'sed_list', 'upload']
+    assert state['lucy']['result'] == 'lucy_7.vtu'
+
+def test_steps_with_nothing_to_do_are_tried_again(tmp_path, pools, fakeSteps):
+    calls, failing, results = fakeSteps
+    results['image'] = None # no image yet
+    pipeline.run(str(tmp_path), pools = pools)
+    del calls[:]
+    del results['image']
+    pipeline.run(str(tmp_path), pools = pools)
+    assert sorted(name for name, inputs in calls) == ['image', 'lucy', 'sed_list', 'upload']
+
+def test_only_rejects_unknown_steps(tmp_path, pools, monkeypatch):
+    with pytest.raises(ValueError):
+        pipeline.run(str(tmp_path), pools = pools, only = ['imgae'])
+    monkeypatch.setattr(sys, 'argv', ['pipeline.py', str(tmp_path), '--only', 'imgae'])
+    with pytest.raises(SystemExit) as e:
+        pipeline.main()
+    assert e.value.code == 2
+
+def test_sink_queues_best_sed_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # the journal is written to the working directory
+    inputs = {'sed': {'sedChis': {'042': [1, 2, 3, 4], '060': [0.5, 0.5, 0.5, 0.5]}, 'png': 'x.png'}}
+
+    assert pipeline.sinkStep('runs/model7/', {}, inputs) == ['model7', 2.0]
+    pipeline.sinkStep('runs/model7/', {}, inputs) # rerun, e.g. with --force
+    assert sheetAppender.pendingCount() == 1
+    assert pipeline.sinkStep('runs/model7/', {'noSink': True}, inputs) is None
+    assert pipeline.sinkStep('runs/model7/', {}, {'sed': None}) is None
+
+def test_upload_logs_in_once(monkeypatch):
+    import pngUpload
+
+    logins = []
+    uploads = []
+    monkeypatch.setattr(pipeline, '_drive', None)
+    monkeypatch.setattr(pngUpload, 'login', lambda: logins.append(1) or ('gauth', 'drive'))
+    def bulkUpload(paths, folder, drive = None, gauth = None):
+        uploads.append((paths, folder, drive, gauth))
+        return {paths[0]: folder}
+    monkeypatch.setattr(pngUpload, 'bulkUpload', bulkUpload)
+
+    inputs = {'sed': {'png': 'm.png'}, 'image': None, 'contours': {'png': 'm_contour_plots.png'}}
+    assert pipeline.uploadStep('m', {}, inputs) == {'m.png': 'SEDs', 'm_contour_plots.png': 'Contours'}
+    pipeline.uploadStep('m', {}, inputs)
+    assert logins == [1]
+    assert all(drive == 'drive' and gauth == 'gauth' for paths, folder, drive, gauth in uploads)
+
+def test_image_needs_a_single_directory(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['pipeline.py', 'a', 'b', '--image', 'a/image.fits'])
+    with pytest.raises(SystemExit) as e:
+        pipeline.main()
+    assert e.value.code == 2
@@ -0,0 +1,95 @@
+"""
+Tests for pngUpload.bulkUpload, using a local stand-in for the Drive service.
+"""
+import json
+import threading
+
+import pytest
+
+import pngUpload
+
+class FakeFile(dict):
+    def __init__(self, drive, metadata):
+        dict.__init__(self, metadata)
+        self.drive = drive
+        self.content = None
+
+    def SetContentFile(self, path):
+        with open(path, 'rb') as f:
+            self.content = f.read()
+
+    def Upload(self, param = None):
+        with self.drive.lock:
+            if self['title'] in self.drive.failTitles:
+                raise ConnectionError('upload failed')
+            self['id'] = 'id' + str(len(self.drive.uploads))
+            self.drive.uploads.append((dict(self), self.content))
+
+class FakeDrive:
+    """
+    Stands in for pydrive's GoogleDrive and remembers every Upload() call.
+    """
+    def __init__(self, failTitles = ()):
+        self.uploads = []
+        self.failTitles = set(failTitles)
+        self.lock = threading.Lock()
+
+    def CreateFile(self, metadata):
+        return FakeFile(self, metadata)
+
+@pytest.fixture
+def pngs(tmp_path):
+    folder = tmp_path / 'plots'
+    folder.mkdir()
+    for name, content in (('a.png', b'a'), ('b.png', b'b'), ('c.png', b'c'), ('copy_of_a.png', b'a'), ('notes.txt', b'x')):
+        (folder / name).write_bytes(content)
+    return folder
+
+@pytest.fixture
+def manifest(tmp_path):
+    return str(tmp_path / 'manifest.json')
+
+def test_each_file_uploaded_once_with_title(pngs, manifest):
+    drive = FakeDrive()
+    uploaded = pngUpload.bulkUpload([str(pngs)], 'SEDs', drive = drive, manifestPath = manifest)
+
+    titles = sorted(meta['title'] for meta, content in drive.uploads)
+    assert titles == ['a.png', 'b.png', 'c.png'] # copy_of_a.png has the same contents as a.png, notes.txt isn't a png
+    for meta, content in drive.uploads:
+        assert meta['parents'] == [{'id': pngUpload.folderIds['SEDs']}]
+        assert content == meta['title'][0].encode()
+    assert len(uploaded) == 3
+
+def test_manifest_skips_uploaded_files(pngs, manifest):
+    pngUpload.bulkUpload([str(pngs)], 'SEDs', drive = FakeDrive(), manifestPath = manifest)
+    assert len(json.load(open(manifest))) == 3
+
+    drive = FakeDrive()
+    assert pngUpload.bulkUpload([str(pngs)], 'SEDs', drive = drive, manifestPath = manifest) == {}
+    assert drive.uploads == []
+
+    (pngs / 'd.png').write_bytes(b'd')
+    assert list(pngUpload.bulkUpload([str(pngs / 'd.png'), str(pngs / 'a.png')], 'SEDs', drive = drive,
+                                     manifestPath = manifest)) == [str(pngs / 'd.png')]
+
+def test_same_file_in_another_folder_is_uploaded(pngs, manifest):
+    pngUpload.bulkUpload([str(pngs / 'a.png')], 'SEDs', drive = FakeDrive(), manifestPath = manifest)
+    drive = FakeDrive()
+    pngUpload.bulkUpload([str(pngs / 'a.png')], 'Images', drive = drive, manifestPath = manifest)
+    assert len(drive.uploads) == 1
+
+def test_unknown_folder(pngs, manifest):
+    with pytest.raises(ValueError, match = 'unknown folder'):
+        pngUpload.bulkUpload([str(pngs)], 'Sed', drive = FakeDrive(), manifestPath = manifest)
+
+def test_failures_are_collected(pngs, manifest):
+    drive = FakeDrive(failTitles = ('a.png', 'c.png'))
+    with pytest.raises(RuntimeError, match = '2 uploads failed') as error:
+        pngUpload.bulkUpload([str(pngs)], 'SEDs', drive = drive, manifestPath = manifest)
+    assert isinstance(error.value.__cause__, ConnectionError)
+
+    # the one that worked is remembered, the failed ones are tried again next time
+    assert [entry['title'] for entry in json.load(open(manifest)).values()] == ['b.png']
+    drive.failTitles.clear()
+    uploaded = pngUpload.bulkUpload([str(pngs)], 'SEDs', drive = drive, manifestPath = manifest)
+    assert sorted(path.split('/')[-1] for path in uploaded) == ['a.png', 'c.png']
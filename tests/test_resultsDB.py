@@ -0,0 +1,31 @@
+"""
+Tests for resultsDB.
+"""
+import resultsDB
+
+def test_param_file_only_found_in_model_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'modParametersNEW.dat').write_text('mdisc 0.1\n') # the last model set up, not ours
+    (tmp_path / 'modelA').mkdir()
+    assert resultsDB.findParamFile('modelA') is None
+    assert resultsDB.findParamFile('') is None
+
+    (tmp_path / 'modelA' / 'modParametersNEW.dat').write_text('mdisc 0.2\n')
+    assert resultsDB.findParamFile('modelA') == 'modelA/modParametersNEW.dat'
+
+def test_record_and_queries(tmp_path):
+    db = str(tmp_path / 'results.db')
+    params = tmp_path / 'modParametersNEW.dat'
+    params.write_text('mdisc 1.0d-3\nnphot 100\n! comment\n')
+
+    resultsDB.record('m1', paramPath = str(params), imageChi = 5.0, path = db)
+    resultsDB.record('m1', paramPath = str(params), sedChis = {'042': (1, 2, 3, 4), '050': (0, 0, 0, 1)},
+                     runtimes = {'sed_chi': 1.2}, artifacts = {'sed_png': 'm1.png'}, path = db)
+    resultsDB.recordMany([{'model': 'm2', 'imageChi': 3.0}], path = db)
+
+    pHash = resultsDB.paramHash(str(params))
+    assert resultsDB.topModels(5, path = db) == [('m2', '', 3.0), ('m1', pHash, 5.0)]
+    assert resultsDB.topModels(5, by = 'total', path = db) == [('m1', pHash, 1.0)]
+    assert resultsDB.topModels(5, by = 'total', inclination = '042', path = db) == [('m1', pHash, 10.0)]
+    assert resultsDB.paramRange('mdisc', 1e-4, 1e-2, path = db) == [('m1', pHash, 0.001)]
+    assert resultsDB.paramRange('mdisc', 1e-2, path = db) == []
@@ -0,0 +1,139 @@
+"""
+Tests for the sheetAppender journal, using a fake in place of the sheets API.
+"""
+import sqlite3
+
+import pytest
+
+import sheetAppender
+
+class FakeSpreadsheet:
+    """
+    Records values_append calls. The first `failures` calls raise, like a flaky network.
+    """
+    def __init__(self, failures = 0):
+        self.calls = []
+        self.attempts = 0
+        self.failures = failures
+
+    def values_append(self, sheetName, params, body):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError('network down')
+        assert params == {'valueInputOption': 'RAW'}
+        self.calls.append((sheetName, body['values']))
+
+@pytest.fixture
+def journal(tmp_path):
+    return str(tmp_path / 'journal.db')
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(sheetAppender.time, 'sleep', slept.append)
+    return slept
+
+def test_batches_split_on_size_and_sheet_changes(journal):
+    for i in range(5):
+        sheetAppender.queueRow('m' + str(i), i, path = journal)
+    sheetAppender.queueRows([['a', 1]], sheetName = 'Other', path = journal)
+    sheetAppender.queueRow('m5', 5, path = journal)
+
+    fake = FakeSpreadsheet()
+    assert sheetAppender.flush(spreadsheet = fake, path = journal, batchSize = 3) == 7
+    assert fake.calls == [('Results', [['m0', 0.0], ['m1', 1.0], ['m2', 2.0]]),
+                          ('Results', [['m3', 3.0], ['m4', 4.0]]),
+                          ('Other', [['a', 1]]),
+                          ('Results', [['m5', 5.0]])]
+    assert sheetAppender.pendingCount(journal) == 0
+
+def test_retries_with_backoff(journal, sleeps):
+    sheetAppender.queueRow('m', 1, path = journal)
+    fake = FakeSpreadsheet(failures = 2)
+    assert sheetAppender.flush(spreadsheet = fake, path = journal, backoff = 0.5) == 1
+    assert sleeps == [0.5, 1.0]
+    assert fake.calls == [('Results', [['m', 1.0]])]
+
+def test_rows_kept_after_failure(journal, sleeps):
+    sheetAppender.queueRow('m', 1, path = journal)
+    fake = FakeSpreadsheet(failures = 10)
+    with pytest.raises(ConnectionError):
+        sheetAppender.flush(spreadsheet = fake, path = journal, retries = 2)
+    assert fake.attempts == 3
+    assert sheetAppender.pendingCount(journal) == 1
+
+    fake.failures = 0 # network back
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 1
+    assert fake.calls == [('Results', [['m', 1.0]])]
+
+def test_rows_survive_restart(journal):
+    sheetAppender.queueRow('m', 1, path = journal) # one "process" queues and exits
+    con = sqlite3.connect(journal)
+    assert con.execute('SELECT COUNT(*) FROM pending').fetchone()[0] == 1
+    con.close()
+
+    fake = FakeSpreadsheet() # another one flushes later
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 1
+    assert fake.calls == [('Results', [['m', 1.0]])]
+
+def test_queueing_not_blocked_while_sending(journal):
+    sheetAppender.queueRow('m', 1, path = journal)
+
+    class Slow(FakeSpreadsheet):
+        def values_append(self, *args):
+            if not self.calls:
+                sheetAppender.queueRow('during', 2, path = journal) # would hit "database is locked" if the journal were held
+            FakeSpreadsheet.values_append(self, *args)
+
+    fake = Slow()
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 2
+    assert fake.calls[0] == ('Results', [['m', 1.0]])
+
+def test_stale_claims_are_taken_over(journal):
+    sheetAppender.queueRow('m', 1, path = journal)
+    con = sqlite3.connect(journal)
+    con.execute("UPDATE pending SET claimed = 0, claimant = 'dead'") # a flush that crashed long ago
+    con.commit()
+    con.close()
+
+    fake = FakeSpreadsheet()
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 1
+    assert sheetAppender.pendingCount(journal) == 0
+
+def test_keyed_rows_are_not_sent_twice(journal):
+    assert sheetAppender.queueRow('m', 1, path = journal, key = 'm')
+    assert not sheetAppender.queueRow('m', 1, path = journal, key = 'm') # already waiting
+    fake = FakeSpreadsheet()
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 1
+
+    assert not sheetAppender.queueRow('m', 1, path = journal, key = 'm') # already sent, e.g. a rerun step
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 0
+    assert fake.calls == [('Results', [['m', 1.0]])]
+
+def test_newer_keyed_row_replaces_unsent_one(journal):
+    sheetAppender.queueRow('m', 1, path = journal, key = 'm')
+    sheetAppender.queueRow('m', 2, path = journal, key = 'm')
+    sheetAppender.queueRow('m', 2, path = journal) # unkeyed rows are always queued
+    fake = FakeSpreadsheet()
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 2
+    assert fake.calls == [('Results', [['m', 2.0], ['m', 2.0]])]
+
+    assert sheetAppender.queueRow('m', 3, path = journal, key = 'm') # a new score is a new row
+    assert sheetAppender.pendingCount(journal) == 1
+
+def test_empty_flush_does_not_authorize(journal, monkeypatch):
+    def openSpreadsheet():
+        raise AssertionError('authorized with nothing to send')
+    monkeypatch.setattr(sheetAppender, 'openSpreadsheet', openSpreadsheet)
+    assert sheetAppender.flush(path = journal) == 0
+
+def test_failed_authorization_keeps_rows(journal, monkeypatch):
+    def openSpreadsheet():
+        raise ModuleNotFoundError("No module named 'gspread'")
+    monkeypatch.setattr(sheetAppender, 'openSpreadsheet', openSpreadsheet)
+    sheetAppender.queueRow('m', 1, path = journal)
+    with pytest.raises(ModuleNotFoundError):
+        sheetAppender.flush(path = journal)
+
+    fake = FakeSpreadsheet() # the claim was given back, so the next flush sends the row right away
+    assert sheetAppender.flush(spreadsheet = fake, path = journal) == 1
@@ -0,0 +1,57 @@
+"""
+Tests for tracing.
+"""
+import json
+import threading
+import tracemalloc
+
+import pytest
+
+import tracing
+
+@pytest.fixture
+def trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, '_events', [])
+    yield str(tmp_path / 'trace.json')
+    tracing.disable()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def test_disabled_stages_record_nothing(trace):
+    tracing.disable()
+    with tracing.stage('x'):
+        pass
+    assert tracing.stage('y') is tracing.stage('z') # the same do-nothing context manager
+    assert tracing.events() == []
+
+def test_times_without_memory(trace):
+    tracing.enable(trace)
+    assert not tracemalloc.is_tracing()
+
+    @tracing.traced('inner')
+    def inner():
+        return 5
+    with tracing.stage('outer', path = 'a.fits'):
+        assert inner() == 5
+    tracing.save()
+
+    events = json.load(open(trace))['traceEvents']
+    assert [e['name'] for e in events] == ['inner', 'outer']
+    assert events[1]['args']['path'] == 'a.fits'
+    assert 'cpu_ms' in events[0]['args']
+    assert all('peak_bytes' not in e['args'] for e in events)
+
+def test_memory_only_on_main_thread(trace):
+    tracing.enable(trace, memory = True)
+    with tracing.stage('outer'):
+        with tracing.stage('inner'):
+            big = bytearray(4 * 10 ** 6)
+        del big
+    thread = threading.Thread(target = lambda: tracing.stage('threaded').__enter__().__exit__(None, None, None))
+    thread.start()
+    thread.join()
+
+    events = {e['name']: e for e in tracing.events()}
+    assert events['inner']['args']['peak_bytes'] >= 4 * 10 ** 6
+    assert events['outer']['args']['peak_bytes'] >= events['inner']['args']['peak_bytes']
+    assert 'peak_bytes' not in events['threaded']['args']
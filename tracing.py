@@ -0,0 +1,152 @@
+"""
+Lightweight timing of the stages of the analysis (reading FITS files, rotating, masking, blurring, the chi loop,
+reading lucy files, contouring, saving pngs, uploading...), to see where the time goes in a slow sweep.
+
+Each stage records its wall time and CPU time. The stages are saved in the Chrome trace format, which can be
+opened at chrome://tracing or https://ui.perfetto.dev to see them on a timeline.
+
+Peak memory is only recorded if PPD_TRACE_MEMORY is also set (or enable(memory = True) is used), because it runs
+tracemalloc, which slows down allocation-heavy stages like the chi loop a lot and so skews their times. Only memory
+allocated through Python and numpy counts, and tracemalloc's peak is shared by the whole process, so the peak is
+only recorded for stages on the main thread (e.g. not for the uploads in pngUpload's thread pool).
+
+Tracing is off unless the PPD_TRACE environment variable is set to the file to write, e.g.
+
+PPD_TRACE=trace_{pid}.json python3 image_chi.py model model.fits
+PPD_TRACE=trace_{pid}.json PPD_TRACE_MEMORY=1 python3 image_chi.py model model.fits
+
+({pid} is replaced with the process id, so several processes don't overwrite each other's traces.)
+The trace is written when the program exits. From Python, call tracing.enable(path) instead.
+
+When tracing is off, stage() hands back the same do-nothing context manager every time, so leaving the
+stages in the code costs next to nothing.
+
+import tracing
+with tracing.stage('image_chi.rotate'):
+    ...
+
+@tracing.traced('image_chi.chi')
+def same_shape_chi(...):
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_enabled = False
+_memory = False
+_path = None
+_events = []
+_local = threading.local()
+_null = contextlib.nullcontext()
+_origin = time.perf_counter()
+
+class _Stage:
+    """
+    Context manager that times one stage and records it when it finishes.
+    """
+    __slots__ = ('name', 'args', 'wall', 'cpu', 'peak', 'memory')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.peak = 0
+        self.memory = _memory and threading.current_thread() is threading.main_thread()
+
+    def __enter__(self):
+        stack = _stack()
+        if self.memory:
+            if stack: # fold the parent's peak so far into it before resetting for this stage
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        stack = _stack()
+        stack.pop()
+        args = {'cpu_ms': cpu * 1000}
+        if self.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            args['peak_bytes'] = self.peak
+        if self.args:
+            args.update(self.args)
+        _events.append({'name': self.name, 'ph': 'X', 'ts': (self.wall - _origin) * 1e6, 'dur': wall * 1e6,
+                        'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+        return False
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def stage(name, **args):
+    """
+    Context manager around one stage. Any keyword arguments are saved with the stage (e.g. the file name).
+    """
+    if not _enabled:
+        return _null
+    return _Stage(name, args)
+
+def traced(name = None):
+    """
+    Decorator that records every call of a function as a stage. The stage name defaults to module.function.
+    """
+    def decorator(func):
+        stageName = name or func.__module__ + '.' + func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stageName, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enable(path = 'trace.json', memory = False):
+    """
+    Starts recording stages, and saves them to path when the program exits. memory turns on tracemalloc
+    to record peak memory, at the cost of slower stages.
+    """
+    global _enabled, _path, _memory
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _path = path.replace('{pid}', str(os.getpid()))
+    if not _enabled:
+        atexit.register(save)
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def events():
+    """
+    The stages recorded so far, as Chrome trace events.
+    """
+    return list(_events)
+
+def save(path = None):
+    """
+    Writes the recorded stages to a Chrome trace file.
+    """
+    path = path or _path
+    if path is None or not _events:
+        return
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': list(_events), 'displayTimeUnit': 'ms'}, f)
+
+if os.environ.get('PPD_TRACE'):
+    enable(os.environ['PPD_TRACE'], memory = bool(os.environ.get('PPD_TRACE_MEMORY')))
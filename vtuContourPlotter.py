@@ -52,6 +52,7 @@ def plot(filename, variable, directory = '', plotsize = 'full'):
     import pyvista as pv
     import matplotlib.pyplot as plt
     import numpy as np
+    import tracing
 
 
     if directory != '':
@@ -59,7 +60,8 @@ def plot(filename, variable, directory = '', plotsize = 'full'):
 
     variable = str(variable)
 
-    grid = pv.read(filename) # read lucy file in as a pyvista mesh
+    with tracing.stage('vtu.read', path = filename):
+        grid = pv.read(filename) # read lucy file in as a pyvista mesh
 
     valArray = grid[variable] # the lucy file is basically a bunch of vtk files stacked on top
                               # of each other, which is why just plotting the lucy file either
@@ -67,20 +69,22 @@ def plot(filename, variable, directory = '', plotsize = 'full'):
                               # only one of the variables (VisIt has all the variable names, working
                               # on getting them to display here)
 
-    minIndexes = []
-    for i in range(len(valArray)): # convert to log values
-        value = valArray[i] # EAR
-        if value > 0: # if value won't throw a log error
-            valArray[i] = np.log10(value) # EAR
-        else: # if the value is too small to log, store the index 
-            minIndexes.append(i)
-
-    minVal = min(valArray) # get the minimum of the logged values
-    for i in minIndexes: # go through the stored indicies and set all those values to the minimum
-        valArray[i] = minVal # EAR
+    with tracing.stage('vtu.log_values', variable = variable):
+        minIndexes = []
+        for i in range(len(valArray)): # convert to log values
+            value = valArray[i] # EAR
+            if value > 0: # if value won't throw a log error
+                valArray[i] = np.log10(value) # EAR
+            else: # if the value is too small to log, store the index 
+                minIndexes.append(i)
+
+        minVal = min(valArray) # get the minimum of the logged values
+        for i in minIndexes: # go through the stored indicies and set all those values to the minimum
+            valArray[i] = minVal # EAR
     
-    centers = grid.cell_centers() # plot the center points for the contour
-    centerPoints = np.asarray(centers.GetPoints().GetData())
+    with tracing.stage('vtu.cell_centers'):
+        centers = grid.cell_centers() # plot the center points for the contour
+        centerPoints = np.asarray(centers.GetPoints().GetData())
     scale = 6.685 * (10 ** -4)
     centerX = centerPoints[:,0] * scale
     centerY = centerPoints[:,1] * scale
@@ -133,6 +137,7 @@ def bigPlot(filename, directory = '', min = 10, mid = 100,
     """
 
     import matplotlib.pyplot as plt
+    import tracing
 
     fig = plt.figure(figsize=(18, 4 * len(variableNames)))
     subfigs = fig.subfigures(len(variableNames),1) # one subfig for each variable
@@ -153,19 +158,22 @@ def bigPlot(filename, directory = '', min = 10, mid = 100,
         data1 = plot(filename, variable, directory,  plotsize=min)  # these three blocks select the data for each plot
         x1, y1, u1 = data1[0], data1[1], data1[2]
         size1 = data1[3]
-        ax1.tricontourf(x1, y1, u1, levels = levels)
+        with tracing.stage('vtu.contour', variable = variable, plotsize = min):
+            ax1.tricontourf(x1, y1, u1, levels = levels)
         ax1.axis(size1)
 
         data2 = plot(filename, variable, directory,  plotsize=mid)
         x2, y2, u2 = data2[0], data2[1], data2[2]
         size2 = data2[3]
-        ax2.tricontourf(x2, y2, u2, levels = levels)
+        with tracing.stage('vtu.contour', variable = variable, plotsize = mid):
+            ax2.tricontourf(x2, y2, u2, levels = levels)
         ax2.axis(size2)
 
         data3 = plot(filename, variable, directory)
         x3, y3, u3 = data3[0], data3[1], data3[2]
         size3 = data3[3]
-        im = ax3.tricontourf(x3, y3, u3, levels = levels)
+        with tracing.stage('vtu.contour', variable = variable, plotsize = 'full'):
+            im = ax3.tricontourf(x3, y3, u3, levels = levels)
         ax3.axis(size3)
 
         cbar = fig.colorbar(im, ax = [ax1, ax2, ax3]) # add colorbar to each figure
@@ -184,10 +192,11 @@ def bigPlot(filename, directory = '', min = 10, mid = 100,
         subfigs[i].supylabel('Polar distance (AU)',  fontsize = 'x-large', x = 0.09)
     plt.subplots_adjust(bottom=0.15, right = 0.77)
 
-    if directory == '':
-        plt.savefig(filename.split('.')[0] + '.png')
-    else:
-        plt.savefig(directory + '_contour_plots.png') # adjust for personal preference
+    with tracing.stage('vtu.render'):
+        if directory == '':
+            plt.savefig(filename.split('.')[0] + '.png')
+        else:
+            plt.savefig(directory + '_contour_plots.png') # adjust for personal preference
 
     plt.close() # EAR
 
@@ -317,17 +326,13 @@ def plot_density_with_scattering(scatterPath, vtuPath, tauHeight = 1):
     plt.show()
     return
 
-def main():
+def latest_lucy(directory):
     """
-    The main function. Runnable from command line. Iterates through the provided directory
-    to find the latest lucy file, then saves an image of the plot if a lucy file was found.
-    Uses the default variables and magnifications given in bigPlot().
+    Returns the name of the latest lucy .vtu file in directory (the one with the highest number), or None
+    if there aren't any.
     """
-    import sys
     import os
 
-    directory = str(sys.argv[1])
-
     total_dir_list = os.listdir(directory) # all files in directory
     lucy_list = []
     for file in total_dir_list:
@@ -342,7 +347,19 @@ def main():
         if lucyNum > maxLucy: # iterate to get the latest lucy file
             maxLucy = lucyNum
             maxFile = file
-    
+    return maxFile
+
+def main():
+    """
+    The main function. Runnable from command line. Iterates through the provided directory
+    to find the latest lucy file, then saves an image of the plot if a lucy file was found.
+    Uses the default variables and magnifications given in bigPlot().
+    """
+    import sys
+
+    directory = str(sys.argv[1])
+
+    maxFile = latest_lucy(directory)
     if maxFile != None: # only plot if there is a lucy file
         bigPlot(maxFile, directory)
 
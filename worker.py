@@ -0,0 +1,176 @@
+"""
+A long-running worker that keeps astropy, scipy, matplotlib, pyvista and the observations loaded between models,
+so each model only pays for the actual scoring and plotting instead of the imports and re-reading the GPI image
+and photometry every time.
+
+The worker keeps in memory:
+    - the processed (masked and blurred) observed image
+    - the masks made by image_chi.create_full_mask
+    - the parsed and reddening-corrected photometry (plotter.readData)
+Each of these is reloaded automatically if its file changes.
+
+Start the worker in the directory with the observation files:
+
+python3 worker.py serve &
+
+and then send it jobs from the same directory (the client only imports the standard library, so it starts quickly):
+
+python3 worker.py image modelname model_image.fits     -- same as python3 image_chi.py modelname model_image.fits
+python3 worker.py sed directory                        -- same as python3 plotter.py directory
+python3 worker.py contours directory                   -- same as python3 vtuContourPlotter.py directory
+python3 worker.py ping
+python3 worker.py stop
+
+Jobs are sent over a Unix socket and run one at a time, in the client's working directory. Relative paths work
+the same way as when running the scripts directly. The socket is ppd_worker.sock in $XDG_RUNTIME_DIR (or the home
+directory if that isn't set), so clients find the worker from any directory; set PPD_WORKER_SOCKET to use a
+different one, e.g. to run two workers.
+"""
+import json
+import os
+import socket
+import sys
+
+def defaultSocketPath():
+    if os.environ.get('PPD_WORKER_SOCKET'):
+        return os.path.abspath(os.environ['PPD_WORKER_SOCKET'])
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser('~'), 'ppd_worker.sock')
+
+socket_path = defaultSocketPath()
+
+def request(job, args = (), path = socket_path):
+    """
+    Sends one job to the worker and returns its reply: {'ok': True, 'result': ..., 'seconds': ...} or
+    {'ok': False, 'error': traceback}.
+    """
+    message = json.dumps({'job': job, 'args': list(args), 'cwd': os.getcwd()}) + '\n'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(message.encode())
+        reply = sock.makefile('r').readline()
+    if reply == '':
+        raise ConnectionError('the worker closed the connection without replying')
+    return json.loads(reply)
+
+class Worker:
+    """
+    The state kept between jobs, and the jobs themselves.
+    """
+    def __init__(self):
+        import matplotlib
+        matplotlib.use('Agg') # no windows from a background process
+        import image_chi
+        import plotter
+        import vtuContourPlotter
+        import pyvista # not used here, but vtuContourPlotter imports it inside its functions, so load it now
+
+        self.image_chi = image_chi
+        self.plotter = plotter
+        self.vtuContourPlotter = vtuContourPlotter
+        self.obs = {}
+
+    def processedObs(self, obsPath):
+        """
+        The processed observed image, only redone when the file changes.
+        """
+        key = (os.path.abspath(obsPath), os.path.getmtime(obsPath))
+        if key not in self.obs:
+            self.obs.clear()
+            self.obs[key] = self.image_chi.process_obs(obsPath)
+        return self.obs[key]
+
+    def warm(self):
+        """
+        Loads whichever observation files are in the working directory before the first job.
+        """
+        if os.path.exists('MWC_275_GPI_2014-04-24_J.fits'):
+            self.processedObs('MWC_275_GPI_2014-04-24_J.fits')
+        if os.path.exists('mwc275_phot_cleaned_0.dat'):
+            self.plotter.readData('mwc275_phot_cleaned_0.dat')
+
+    def image(self, modelname, pathname, obsPath = 'MWC_275_GPI_2014-04-24_J.fits'):
+        chi = self.image_chi.score_image(modelname, pathname, obsPath, image_obs = self.processedObs(obsPath))
+        return float(chi)
+
+    def sed(self, directory):
+        return self.plotter.main(directory)
+
+    def contours(self, directory):
+        maxFile = self.vtuContourPlotter.latest_lucy(directory)
+        if maxFile != None: # only plot if there is a lucy file
+            self.vtuContourPlotter.bigPlot(maxFile, directory)
+        return maxFile
+
+    def ping(self):
+        return 'pong'
+
+    def run(self, job, args):
+        if job not in ('image', 'sed', 'contours', 'ping'):
+            raise ValueError('unknown job ' + repr(job))
+        return getattr(self, job)(*args)
+
+def serve(path = socket_path):
+    """
+    Runs the worker until it gets a stop job.
+    """
+    import socketserver
+    import threading
+    import time
+    import traceback
+
+    path = os.path.abspath(path) # the handler changes directory, so a relative path would go stale
+    worker = Worker()
+    worker.warm()
+    home = os.getcwd()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            message = json.loads(self.rfile.readline())
+            if message['job'] == 'stop':
+                reply = {'ok': True, 'result': 'stopping'}
+                threading.Thread(target = self.server.shutdown).start()
+            else:
+                start = time.perf_counter()
+                try:
+                    os.chdir(message.get('cwd', home))
+                    reply = {'ok': True, 'result': worker.run(message['job'], message.get('args', []))}
+                except Exception:
+                    reply = {'ok': False, 'error': traceback.format_exc()}
+                finally:
+                    os.chdir(home)
+                reply['seconds'] = time.perf_counter() - start
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+
+    if os.path.exists(path):
+        try:
+            request('ping', path = path)
+        except OSError:
+            os.remove(path) # left over from a worker that didn't shut down cleanly
+        else:
+            raise RuntimeError('a worker is already listening on ' + path)
+
+    server = socketserver.UnixStreamServer(path, Handler) # jobs run one at a time; matplotlib isn't thread-safe
+    print('worker listening on ' + path, flush = True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def main():
+    if sys.argv[1] == 'serve':
+        serve()
+        return
+
+    try:
+        reply = request(sys.argv[1], sys.argv[2:])
+    except OSError:
+        print('no worker is running on ' + socket_path + ' (start one with python3 worker.py serve)', file = sys.stderr)
+        sys.exit(2)
+    if not reply['ok']:
+        print(reply['error'], file = sys.stderr)
+        sys.exit(1)
+    print(json.dumps(reply['result']))
+
+if __name__ == '__main__':
+    main()